@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# Benchmark the label generation pipeline on synthetic tables. Each case runs
+# make_labels_from_table in a separate process and reports labels/sec, pages/sec,
+# peak RSS and output PDF size. Results can be saved as JSON and compared with a
+# previous run.
+
+from __future__ import print_function
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import zlib
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "examples")
+CONFIGS = ("small", "big")
+VARIANTS = ("plain", "qr", "icons", "wrap", "scale", "copies")
+WORDS = ("sample", "aliquot", "plasma", "serum", "frozen", "on", "dry", "ice", "do",
+    "not", "thaw", "patient", "visit", "baseline", "follow-up", "see", "LIMS", "record")
+
+class Counter(object):
+    """Stands in for a ProgressReporter, counting rows and pages silently."""
+    def __init__(self):
+        self.rows = 0
+        self.pages = 0
+
+    def row(self):
+        self.rows += 1
+
+    def page(self, page_count):
+        self.pages = page_count
+
+def write_icon(path, rgb, size=32):
+    """Write a solid-color PNG, so that the benchmark does not need any image files."""
+    def chunk(kind, data):
+        body = kind + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body) & 0xffffffff)
+    row = b"\0" + bytes(bytearray(rgb * size))
+    with open(path, "wb") as o:
+        o.write(b"\x89PNG\r\n\x1a\n")
+        o.write(chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)))
+        o.write(chunk(b"IDAT", zlib.compress(row * size)))
+        o.write(chunk(b"IEND", b""))
+
+def write_table(path, rows, extra_columns, description_words, copies, seed):
+    """Write a synthetic CSV table. `extra_columns` unused columns make the table as
+    wide as a typical LIMS export."""
+    rng = random.Random(seed)
+    header = ["Name", "Description", "Location", "URL", "Icons", "Count"]
+    header.extend("Extra{0}".format(i+1) for i in range(extra_columns))
+    with open(path, "w") as o:
+        o.write(",".join(header) + "\n")
+        for i in range(rows):
+            row = [
+                "S{0:07d}".format(i),
+                " ".join(rng.choice(WORDS) for j in range(description_words)),
+                "Freezer {0} / Rack {1} / Box {2}".format(rng.randint(1, 9),
+                    rng.randint(1, 20), rng.randint(1, 100)),
+                "https://lims.example.org/samples/S{0:07d}".format(i),
+                rng.choice(("C", "P", "CP")),
+                str(copies)
+            ]
+            row.extend(str(rng.random()) for j in range(extra_columns))
+            o.write(",".join(row) + "\n")
+
+def label_config(name, variant, icons, font_path):
+    """Load an example label config and adapt it to a benchmark variant."""
+    with open(os.path.join(EXAMPLES, "{0}-labels.json".format(name))) as i:
+        config = json.load(i)
+    if variant == "plain":
+        del config["qr"]
+    if variant == "icons":
+        config["icons"] = icons
+    if variant in ("wrap", "scale"):
+        config["text"]["shrink"] = variant
+    if font_path:
+        config["fontPath"] = list(font_path) + config.get("fontPath", [])
+    return config
+
+def run_case(queue, args, tables, icons, name, variant):
+    from labelmaker.labelmaker import make_labels_from_table, prepare_config
+    from labelmaker.util import CsvReader
+
+    result = dict(config=name, variant=variant)
+    try:
+        with open(os.path.join(EXAMPLES, "..", "labelmaker", "config", "page-config.json")) as i:
+            page_config = json.load(i)
+        config = prepare_config(label_config(name, variant, icons, args.font_path), page_config)
+        lines = config["text"]["lines"]
+        text_strings = ["{Name}", "{Description}", "{Location}"][:lines]
+        qr_string = "{URL}" if config["qr"] else None
+        icon_column = "Icons" if variant == "icons" else None
+        count_column = "Count" if variant == "copies" else None
+        table = tables["copies" if variant == "copies" else "single"]
+        outfile = os.path.join(args.workdir, "{0}-{1}.pdf".format(name, variant))
+
+        counter = Counter()
+        reader = CsvReader(table, True)
+        start = time.time()
+        try:
+            make_labels_from_table(reader, text_strings, qr_string, icon_column, count_column,
+                None, outfile, config, progress=counter, jobs=args.jobs,
+                renderer=args.renderer)
+        finally:
+            reader.close()
+        seconds = time.time() - start
+
+        labels = counter.rows * (args.copies if variant == "copies" else 1)
+        # ru_maxrss is in kilobytes on Linux and bytes on OS X
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":
+            rss /= 1024.0
+        result.update(
+            rows=counter.rows,
+            labels=labels,
+            pages=counter.pages,
+            seconds=seconds,
+            labels_per_sec=labels / seconds,
+            pages_per_sec=counter.pages / seconds,
+            peak_rss_mb=rss / 1024.0,
+            pdf_bytes=os.path.getsize(outfile))
+
+    except Exception as e:
+        result["error"] = "{0}: {1}".format(e.__class__.__name__, e)
+
+    queue.put(result)
+
+def compare(results, baseline):
+    """Print the ratio of labels/sec to a previous run."""
+    previous = dict(((r["config"], r["variant"]), r) for r in baseline["results"])
+    print("\n{0:<16} {1:>14} {2:>14} {3:>8}".format(
+        "case", "labels/s (old)", "labels/s (new)", "ratio"))
+    for r in results:
+        old = previous.get((r["config"], r["variant"]), None)
+        if old is None or "error" in r or "error" in old:
+            continue
+        print("{0:<16} {1:>14.1f} {2:>14.1f} {3:>7.2f}x".format(
+            "{0}/{1}".format(r["config"], r["variant"]), old["labels_per_sec"],
+            r["labels_per_sec"], r["labels_per_sec"] / old["labels_per_sec"]))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--rows", type=int, default=1000,
+        help="Number of rows in the synthetic table.")
+    parser.add_argument("--copies", type=int, default=12,
+        help="Number of copies of each row in the 'copies' variant.")
+    parser.add_argument("--extra-columns", type=int, default=50,
+        help="Number of unused columns in the synthetic table.")
+    parser.add_argument("--description-words", type=int, default=12,
+        help="Number of words in the description column.")
+    parser.add_argument("-c", "--configs", nargs="*", choices=CONFIGS, default=CONFIGS,
+        help="Example label configs to benchmark.")
+    parser.add_argument("-v", "--variants", nargs="*", choices=VARIANTS, default=VARIANTS,
+        help="Variants to benchmark.")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+        help="Number of processes to use for drawing labels.")
+    parser.add_argument("-r", "--renderer", choices=("drawing", "canvas", "zpl"), default="drawing",
+        help="Renderer to use for drawing labels.")
+    parser.add_argument("--font-path", nargs="*", default=None,
+        help="Extra directories to search for fonts (the 'small' config uses Tahoma).")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workdir", default=None,
+        help="Directory for tables and PDFs; a temporary directory by default.")
+    parser.add_argument("-o", "--output", default=None,
+        help="Write results to this JSON file.")
+    parser.add_argument("--compare", default=None,
+        help="JSON file from a previous run to compare against.")
+    args = parser.parse_args()
+
+    cleanup = args.workdir is None
+    if cleanup:
+        args.workdir = tempfile.mkdtemp(prefix="labelmaker-bench-")
+
+    try:
+        icons = dict(C=os.path.join(args.workdir, "c.png"), P=os.path.join(args.workdir, "p.png"))
+        write_icon(icons["C"], (255, 200, 0))
+        write_icon(icons["P"], (200, 0, 0))
+        tables = dict(
+            single=os.path.join(args.workdir, "single.csv"),
+            copies=os.path.join(args.workdir, "copies.csv"))
+        write_table(tables["single"], args.rows, args.extra_columns, args.description_words,
+            1, args.seed)
+        write_table(tables["copies"], max(args.rows // args.copies, 1), args.extra_columns,
+            args.description_words, args.copies, args.seed)
+
+        print("{0:<16} {1:>8} {2:>7} {3:>10} {4:>9} {5:>9} {6:>10}".format(
+            "case", "labels", "pages", "labels/s", "pages/s", "RSS (MB)", "PDF (KB)"))
+        results = []
+        for name in args.configs:
+            for variant in args.variants:
+                queue = multiprocessing.Queue()
+                proc = multiprocessing.Process(target=run_case,
+                    args=(queue, args, tables, icons, name, variant))
+                proc.start()
+                result = queue.get()
+                proc.join()
+                results.append(result)
+
+                case = "{0}/{1}".format(name, variant)
+                if "error" in result:
+                    print("{0:<16} {1}".format(case, result["error"]))
+                else:
+                    print("{0:<16} {1:>8} {2:>7} {3:>10.1f} {4:>9.2f} {5:>9.1f} {6:>10.1f}".format(
+                        case, result["labels"], result["pages"], result["labels_per_sec"],
+                        result["pages_per_sec"], result["peak_rss_mb"],
+                        result["pdf_bytes"] / 1024.0))
+
+    finally:
+        if cleanup:
+            shutil.rmtree(args.workdir)
+
+    if args.output:
+        meta = dict(
+            date=datetime.datetime.now().isoformat(),
+            python=platform.python_version(),
+            platform=platform.platform(),
+            rows=args.rows,
+            copies=args.copies,
+            extra_columns=args.extra_columns,
+            description_words=args.description_words,
+            jobs=args.jobs,
+            renderer=args.renderer)
+        with open(args.output, "w") as o:
+            json.dump(dict(meta=meta, results=results), o, indent=2)
+
+    if args.compare:
+        with open(args.compare) as i:
+            compare(results, json.load(i))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# Benchmark startup: the time to import labelmaker, to run make-labels.py --help, and
+# to read the example configs with and without the compiled config cache. Each
+# measurement runs in a fresh interpreter and the median of several runs is reported.
+
+from __future__ import print_function
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+EXAMPLES = os.path.join(ROOT, "examples")
+
+# Timing is done inside the child process, so interpreter startup is not included
+IMPORT = """
+import time
+start = time.time()
+import {0}
+print(time.time() - start)
+"""
+
+READ_CONFIG = """
+import time
+start = time.time()
+from labelmaker.labelmaker import read_config
+imported = time.time()
+read_config({0!r}, None, {1!r})
+print(time.time() - imported)
+"""
+
+def child(code):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(p for p in (ROOT, env.get("PYTHONPATH")) if p)
+    return float(subprocess.check_output([sys.executable, "-c", code], env=env))
+
+def command(args):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(p for p in (ROOT, env.get("PYTHONPATH")) if p)
+    with open(os.devnull, "w") as devnull:
+        start = time.time()
+        subprocess.check_call([sys.executable] + args, env=env, stdout=devnull)
+        return time.time() - start
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--repeat", type=int, default=5,
+        help="Number of times to run each measurement.")
+    parser.add_argument("-c", "--config", default="big",
+        help="Example label config to read.")
+    args = parser.parse_args()
+
+    label_config = os.path.join(EXAMPLES, "{0}-labels.json".format(args.config))
+    cache_dir = tempfile.mkdtemp(prefix="labelmaker-startup-")
+    try:
+        # Make sure the cache is warm for the cached measurement
+        child(READ_CONFIG.format(label_config, cache_dir))
+        cases = (
+            ("python (startup only)", lambda: command(["-c", "pass"])),
+            ("make-labels.py --help", lambda: command(
+                [os.path.join(ROOT, "bin", "make-labels.py"), "--help"])),
+            ("import labelmaker.util", lambda: child(IMPORT.format("labelmaker.util"))),
+            ("import labelmaker.labelmaker", lambda: child(IMPORT.format("labelmaker.labelmaker"))),
+            ("read_config", lambda: child(READ_CONFIG.format(label_config, None))),
+            ("read_config (cached)", lambda: child(READ_CONFIG.format(label_config, cache_dir))))
+
+        print("{0:<30} {1:>10}".format("case", "ms"))
+        for name, fn in cases:
+            seconds = median(list(fn() for i in range(args.repeat)))
+            print("{0:<30} {1:>10.1f}".format(name, 1000 * seconds))
+    finally:
+        shutil.rmtree(cache_dir)
+
+if __name__ == "__main__":
+    main()
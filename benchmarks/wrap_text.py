@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# Compare wrap_text with the original implementation, which lowers the number of
+# characters per line one step at a time. Both should give the same lines.
+
+from __future__ import print_function
+import argparse
+import random
+import textwrap
+import timeit
+
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from labelmaker.labelmaker import wrap_text
+
+WORDS = ("sample", "aliquot", "plasma", "frozen", "on", "dry", "ice", "do", "not", 
+    "thaw", "patient", "consent", "withdrawn", "see", "LIMS", "record", "for", "details",
+    "co-culture", "re-frozen", "pre-PCR")
+
+def linear_wrap_text(text, max_width, font_name="Helvetica", font_size=50):
+    """The original wrap_text."""
+    text_width = stringWidth(text, font_name, font_size)
+    nchar = len(text)
+    new_text = [text]
+    while text_width > max_width:
+        nchar -= 1
+        new_text = textwrap.wrap(text, nchar)
+        text_width = max(stringWidth(t, font_name, font_size) for t in new_text)
+    return new_text
+
+def random_text(nchar, rng):
+    words = []
+    length = 0
+    while length < nchar:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:nchar].strip()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-l", "--lengths", type=int, nargs="*", 
+        default=(20, 50, 100, 200, 500, 1000),
+        help="Text lengths (in characters) to benchmark.")
+    parser.add_argument("-w", "--max-width", type=float, default=120,
+        help="Available width in points.")
+    parser.add_argument("--font-name", default="Helvetica")
+    parser.add_argument("--font-size", type=float, default=9)
+    parser.add_argument("-n", "--number", type=int, default=20,
+        help="Number of calls to time for each length.")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    
+    rng = random.Random(args.seed)
+    print("{0:>8} {1:>12} {2:>14} {3:>8} {4:>6}".format(
+        "length", "linear (ms)", "wrap_text (ms)", "speedup", "same"))
+    for length in args.lengths:
+        text = random_text(length, rng)
+        call_args = (text, args.max_width, args.font_name, args.font_size)
+        linear = timeit.timeit(lambda: linear_wrap_text(*call_args), number=args.number)
+        fast = timeit.timeit(lambda: wrap_text(*call_args), number=args.number)
+        same = linear_wrap_text(*call_args) == wrap_text(*call_args)
+        print("{0:>8} {1:>12.3f} {2:>14.3f} {3:>7.1f}x {4:>6}".format(
+            length, 1000 * linear / args.number, 1000 * fast / args.number, 
+            linear / fast, "yes" if same else "no"))
+
+if __name__ == "__main__":
+    main()
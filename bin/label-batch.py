@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# Make labels for many input tables in one run. Jobs are given as input files on the
+# command line, or as a manifest of JSON jobs, one per line, in the format accepted by
+# label-server.py (see labelmaker/service.py). Options given on the command line are
+# defaults for every job. Each config is prepared once, and jobs can be run by
+# several processes at once. A response is written to stdout for each job, with
+# the time it took and any error; a failed job does not stop the batch.
+
+import argparse
+import json
+import os
+import sys
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("inputs", nargs="*", default=(),
+        help="CSV or Excel input files; each is a job.")
+    parser.add_argument("-m", "--manifest", default=None,
+        help="File of jobs, one JSON object per line ('-' for stdin).")
+    parser.add_argument("-l", "--label-config", default=None,
+        help="Path to label config file, for jobs that do not specify one.")
+    parser.add_argument("-p", "--page-config", default=None,
+        help="Path to page config file, for jobs that do not specify one.")
+    parser.add_argument("-t", "--text-strings", nargs="*", default=None,
+        help="Text strings, for jobs that do not specify them.")
+    parser.add_argument("-q", "--qr-string", default=None,
+        help="String to encode in the QR code, for jobs that do not specify one.")
+    parser.add_argument("-i", "--icon-column", default=None,
+        help="Name of column listing icons, for jobs that do not specify one.")
+    parser.add_argument("-c", "--count-column", default=None,
+        help="Name of column specifying label counts, for jobs that do not specify one.")
+    parser.add_argument("-n", "--index-string", default=None,
+        help="String specifying the label index, for jobs that do not specify one.")
+    parser.add_argument("-H", "--no-header", action="store_true", default=False,
+        help="Input files have no header line.")
+    parser.add_argument("--delimiter", default=",",
+        help="Input file delimiter.")
+    parser.add_argument("-r", "--renderer", choices=("canvas", "drawing", "zpl"),
+        default="drawing",
+        help="How labels are rendered (see make-labels.py).")
+    parser.add_argument("-o", "--outdir", default=None,
+        help="Directory for the output files of jobs that do not specify one; by "\
+             "default, each output file is written next to its input file.")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+        help="Number of processes to run jobs with.")
+    args = parser.parse_args()
+    
+    if not args.inputs and args.manifest is None:
+        parser.error("No input files or manifest")
+    
+    from labelmaker.service import run_batch
+    from labelmaker.util import clock
+    
+    if args.outdir is not None and not os.path.isdir(args.outdir):
+        os.makedirs(args.outdir)
+    
+    start = clock()
+    defaults = dict(
+        labelConfig=args.label_config,
+        textStrings=args.text_strings, qrString=args.qr_string,
+        iconColumn=args.icon_column, countColumn=args.count_column,
+        indexString=args.index_string, header=not args.no_header,
+        delimiter=args.delimiter, renderer=args.renderer)
+    defaults = dict((k, v) for k, v in defaults.items() if v is not None)
+    
+    jobs = []
+    invalid = 0
+    for path in args.inputs:
+        key = "workbook" if os.path.splitext(path)[1] in (".xls", ".xlsx") else "infile"
+        jobs.append({"id": path, key: path})
+    if args.manifest is not None:
+        manifest = sys.stdin if args.manifest == "-" else open(args.manifest, "rU")
+        with manifest:
+            for lineno, line in enumerate(manifest, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    job = json.loads(line)
+                except ValueError as e:
+                    write_response(dict(id=None, error="Invalid job on line {0}: {1}".format(
+                        lineno, e), ms=0))
+                    invalid += 1
+                    continue
+                job.setdefault("id", lineno)
+                jobs.append(job)
+    
+    for job in jobs:
+        for key, value in defaults.items():
+            job.setdefault(key, value)
+        if "outfile" not in job:
+            job["outfile"] = default_outfile(job, args.outdir)
+    
+    failed = invalid
+    for response in run_batch(jobs, args.jobs, args.page_config):
+        if "error" in response:
+            failed += 1
+        write_response(response)
+    
+    sys.stderr.write("{0} jobs, {1} failed, {2:.1f} s\n".format(
+        len(jobs) + invalid, failed, clock() - start))
+    if failed:
+        sys.exit(1)
+
+def default_outfile(job, outdir):
+    """Output file named after the job's input file."""
+    infile = job.get("infile", job.get("workbook", None))
+    if infile is None:
+        return None
+    root = os.path.splitext(infile)[0]
+    if outdir is not None:
+        root = os.path.join(outdir, os.path.basename(root))
+    return root + (".zpl" if job.get("renderer", None) == "zpl" else ".pdf")
+
+def write_response(response):
+    sys.stdout.write(json.dumps(response) + "\n")
+    sys.stdout.flush()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# Inspect or clear the page cache used by make-labels.py --page-cache.
+
+import argparse
+import datetime
+
+from labelmaker.pagecache import PageCache
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=("info", "list", "clear", "evict"),
+        help="info: number and total size of cached pages; list: each cached page, "\
+             "least recently used first; clear: remove all pages; evict: remove the "\
+             "least recently used pages until the cache is no larger than --max-size.")
+    parser.add_argument("-d", "--dir", default=None,
+        help="Cache directory (by default ~/.cache/labelmaker/pages).")
+    parser.add_argument("--max-size", type=int, default=256,
+        help="Maximum size of the cache, in MB, for the evict command.")
+    args = parser.parse_args()
+    
+    cache = PageCache(args.dir, args.max_size * 1024 * 1024)
+    
+    if args.command == "info":
+        entries = cache.entries()
+        print("{0}: {1} pages, {2:.1f} MB".format(cache.path, len(entries), 
+            sum(e[1] for e in entries) / (1024.0 * 1024)))
+    elif args.command == "list":
+        for path, size, mtime in cache.entries():
+            print("{0}\t{1}\t{2}".format(path, size, 
+                datetime.datetime.fromtimestamp(mtime).isoformat()))
+    elif args.command == "clear":
+        print("Removed {0} pages".format(cache.clear()))
+    else:
+        print("Removed {0} pages".format(cache.evict()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# Run label jobs from stdin or a Unix socket, keeping configs, fonts, icons and QR 
+# codes in memory between jobs. See labelmaker/service.py for the job format.
+
+import argparse
+import sys
+
+from labelmaker.service import LabelService
+from labelmaker.util import profiler
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-p", "--page-config", default=None,
+        help="Path to page config file, for jobs that do not specify one.")
+    parser.add_argument("-s", "--socket", default=None,
+        help="Path of a Unix socket to accept jobs on. By default, jobs are read from "\
+             "stdin and responses are written to stdout, one JSON object per line.")
+    parser.add_argument("--profile", action="store_true", default=False,
+        help="Record the time spent in each stage of all jobs, and print a summary "\
+             "to stderr on exit.")
+    args = parser.parse_args()
+    
+    if args.profile:
+        profiler.enable()
+    
+    service = LabelService(args.page_config)
+    try:
+        if args.socket is None:
+            service.serve()
+        else:
+            service.serve_socket(args.socket)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.profile:
+            sys.stderr.write(profiler.summary())
+
+if __name__ == "__main__":
+    main()
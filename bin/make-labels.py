@@ -2,156 +2,7 @@
 # Given a csv file, create labels of different sizes that include text and a QR code.
 
 import argparse
-import csv
-from decimal import Decimal
-import json
-import pkgutil
-
-from labelmaker.labelmaker import *
-from labelmaker.util import *
-#from reportlab.lib import enums
-
-def make_labels_from_table(reader, text_strings, qr_string, icon_column, count_column, index_string,
-        outfile, config, skip=0, label_class=DefaultLabel):
-    """Create one label for each row in a table.
-
-    Keyword arguments:
-    reader       -- csv reader that returns a tuple for each row of a table.
-    text_string  -- tuple of strings for the lines of text on the labels.
-    qr_string    -- string to be encoded in the QR code.
-    icon_column  -- name of column with icons to be shown on the label.
-    count_column -- name of column with count of containers
-    index_string -- string showing the label index
-    outfile      -- PDF file to write.
-    config       -- dict with configuration information; the result of calling `get_config`
-    label_class  -- Object type to create for each label; must have same constructor
-                   signature as DefaultLabel
-    """
-    
-    # Compute the number of points available for drawing/printing.
-    specs = config["spec"]
-    height = float(specs._label_height - (specs._top_padding + specs._bottom_padding)) * units.mm
-    
-    text_format = None
-    text_shrink = "wrap"
-    if "text" in config:
-        text_format = config["text"].get("format", {})
-        text_shrink = config["text"].get("shrink", "wrap")
-
-        if "alignment" in text_format:
-            # shapes version
-            aln_map = dict(
-                left="start",
-                center="middle",
-                right="end",
-                justify="start" # no justify option
-            )
-            text_format["textAnchor"] = safe_map(lambda a: aln_map[a], text_format["alignment"])
-                        
-            # Platypus version
-            # have to map alignment strings to enums
-            #aln_map = dict(
-            #    left=enums.TA_LEFT,
-            #    center=enums.TA_CENTER,
-            #    right=enums.TA_RIGHT,
-            #    justify=enums.TA_JUSTIFY
-            #)
-            #text_format["alignment"] = safe_map(lambda a: aln_map[a], text_format["alignment"])
-    
-    if "qr" in config:
-        compress = config["qr"]["compress"]
-        qr_format = config["qr"].get("format", {})
-        # by default, set the QR to be square, with both sides equal
-        # to the usable height of the label
-        if "barWidth" not in qr_format:
-            qr_format["barWidth"] = qr_format.get("barHeight", height)
-        if "barHeight" not in qr_format:
-            qr_format["barHeight"] = qr_format["barWidth"]
-    
-    if "index" in config and count_column is not None:
-        if index_string is None:
-            index_string = config["index"].get("default", "{_index_} / {_count_}")
-        index_format = config["index"].get("format", {})
-    else:
-        index_string = None
-    
-    label_list = []
-    for row in reader:
-        def make_label(idx):
-            # Add the index varaible to the row
-            row["_index_"] = i + 1
-            # Get the lines of text
-            text = None if text_strings is None else tuple(col.format(**row) for col in text_strings)
-            # Get the data to encode in the QR code
-            qr_data = None if qr_string is None else qr_string.format(**row)
-            # Translate the icon codes into paths to image files
-            icons = []
-            if icon_column is not None and "icons" in config:
-                icons = tuple(config["icons"][i] for i in row[icon_column])
-            index = None if index_string is None else index_string.format(**row)
-            # Create the label
-            return label_class(text, text_format, text_shrink, qr_data, qr_format, icons, index, index_format)
-        
-        count = int(row[count_column]) if count_column is not None and count_column in row else 1
-        row["_count_"] = count
-        for i in xrange(count):
-            label_list.append(make_label(i+1))
-    
-    # Generate the PDF for the labels
-    make_labels(specs, label_list, outfile, skip, 
-        config.get("borders", True), config.get("fontPath", None))
-
-def prepare_config(label_config, page_config):
-    """Prepare configuration information from two JSON config files: labels and specs.
-    
-    Keyword arguments:
-    label_config -- JSON file with configuration information 
-                    for a specific set of labels.
-    page_config  -- JSON file with configuration information 
-                    with layouts of standard label types.
-    """
-    # TODO: exceptions will be raised if any expected keys are missing;
-    # do explicit validation and raise custom exceptions
-    
-    # The 'spec' config entry tells us which spec to use
-    spec_config = label_config["spec"]
-    # Select the requested spec from the spec config
-    page_type, spec_args = page_config["label"][spec_config["name"]]
-    # Resolve the page type into width and height
-    spec_args["sheet_width"], spec_args["sheet_height"] = page_config["page"][page_type]
-    # Padding may be specified in the config; if so, transfer to the spec
-    for side in ('top','bottom','left','right'):
-        key = "{0}_padding".format(side)
-        if key in spec_config:
-            spec_args[key] = spec_config[key]
-    # Convert all spec values to arbitrary precision, to prevent
-    # rounding errors
-    spec_args = dict((k, Decimal(v)) for k,v in spec_args.items())
-    spec = labels.Specification(**spec_args)
-    label_config["spec"] = spec
-    
-    text = False
-    if "text" in label_config:
-        text = label_config["text"]
-        if "lines" not in text:
-            # Use one line of text by default
-            text["lines"] = 1
-    label_config["text"] = text
-    
-    qr = False
-    if "qr" in label_config:
-        qr = label_config["qr"]
-        if "compress" not in qr:
-            # Do not compress QR code data by default
-            qr["compress"] = False
-    label_config["qr"] = qr
-    
-    if "fontPath" in label_config:
-        label_config["fontPath"] = map(
-            lambda path: os.path.abspath(os.path.expanduser(path)),
-            label_config["fontPath"])
-
-    return label_config
+import sys
 
 def main():
     parser = argparse.ArgumentParser()
@@ -191,46 +42,136 @@ def main():
         help="Text input file (CSV unless --delimiter is specified).")
     input_group.add_argument("-x", "--workbook",
         help="Excel input file (first sheet is loaded unless --sheet is specified).")
-    parser.add_argument("-o", "--outfile", required=True)
+    parser.add_argument("-o", "--outfile", default=None,
+        help="Output PDF (or ZPL) file. With --pages-per-file, files are numbered from this name, "\
+             "e.g. labels-001.pdf, labels-002.pdf for labels.pdf.")
+    parser.add_argument("--pages-per-file", type=int, default=None,
+        help="Split the output into files of at most this many pages.")
+    parser.add_argument("--start-page", type=int, default=1,
+        help="First page to write (e.g. to make one file of a split job again).")
+    parser.add_argument("--end-page", type=int, default=None,
+        help="Last page to write.")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+        help="Number of processes to use for drawing labels.")
+    parser.add_argument("-r", "--renderer", choices=("canvas", "drawing", "zpl"), 
+        default="drawing",
+        help="How labels are rendered: 'drawing' builds each page as a reportlab Drawing, "\
+             "while 'canvas' draws labels straight onto the PDF, which is faster but "\
+             "cannot be combined with --jobs. 'zpl' writes ZPL for a Zebra thermal "\
+             "printer instead of a PDF, one label per page.")
+    parser.add_argument("--page-cache", nargs="?", const="", default=None,
+        help="Reuse pages that are unchanged since a previous run from a cache in this "\
+             "directory (by default ~/.cache/labelmaker/pages), and only render pages "\
+             "that have changed. Requires PyPDF2.")
+    parser.add_argument("--page-cache-size", type=int, default=256,
+        help="Maximum size of the page cache, in MB; the least recently used pages "\
+             "are removed when it is full.")
+    parser.add_argument("--config-cache", default="~/.cache/labelmaker/configs",
+        help="Directory in which prepared configs are cached, so that they are only "\
+             "prepared again when the config files change.")
+    parser.add_argument("--no-config-cache", action="store_true", default=False,
+        help="Do not cache prepared configs.")
+    parser.add_argument("--profile", nargs="?", const="-", default=None,
+        help="Record the time spent in each stage of the job, and counts of labels, "\
+             "pages and QR code bytes. The summary is printed to stderr, or written "\
+             "as JSON to the given file.")
+    parser.add_argument("--progress", action="store_true", default=False,
+        help="Report the number of rows read and pages written to stderr.")
+    parser.add_argument("--check", action="store_true", default=False,
+        help="Do not make labels; instead, list the rows whose text would be scaled, "\
+             "wrapped or truncated to fit on the labels. Exits with status 1 if any "\
+             "text would be truncated.")
     args = parser.parse_args()
+    if args.outfile is None and not args.check:
+        parser.error("argument -o/--outfile is required")
+    if args.jobs > 1 and args.renderer != "drawing":
+        parser.error("argument -j/--jobs requires the 'drawing' renderer")
+    if args.jobs > 1 and args.page_cache is not None:
+        parser.error("argument -j/--jobs cannot be combined with --page-cache")
+    if args.start_page < 1:
+        parser.error("argument --start-page must be at least 1")
+    if args.end_page is not None and args.end_page < args.start_page:
+        parser.error("argument --end-page must not be less than --start-page")
+    
+    # reportlab takes a while to import, so it is not imported until the arguments
+    # have been parsed; --help and usage errors do not have to wait for it
+    from labelmaker.labelmaker import (
+        check_table, default_templates, make_labels_from_table, qr_cache, read_config)
+    from labelmaker.pagecache import PageCache
+    from labelmaker.util import CsvReader, ExcelReader, ProgressReporter, profiler
+    
+    if args.profile is not None:
+        profiler.enable()
 
-    with open(args.label_config, "rU") as i:
-        label_config = json.load(i)
-    
-    if args.page_config is None:
-        page_config = json.loads(pkgutil.get_data("labelmaker", "config/page-config.json"))
-    else:
-        with open(args.page_config, "rU") as i:
-            page_config = json.load(i)
-    
-    config = prepare_config(label_config, page_config)
-    
-    text_strings = None
-    if config["text"] and config["text"]["lines"] > 0:
-        if args.text_strings is None:
-            text_strings = list("{{col{0}}}".format(i+1) for i in xrange(config["text"]["lines"]))
-        else:
-            text_strings = args.text_strings
-            assert len(text_strings) == config["text"]["lines"]
-    
-    qr_string = None
-    if config["qr"]:
-        qr_string = args.qr_string or text_strings[0] if text_strings is not None else "{col1}"
+    config_cache = None if args.no_config_cache else args.config_cache
+    config = read_config(args.label_config, args.page_config, config_cache)
+    text_strings, qr_string = default_templates(config, args.text_strings, args.qr_string)
     
     header = not args.no_header
     if args.infile:    
-        reader = AliasedDictReader(args.infile, header,
+        reader = CsvReader(args.infile, header,
             delimiter=args.delimiter, skipinitialspace=True)
     else:
         date_format = config.get("dateFormat", "%Y-%m-%d")
         reader = ExcelReader(args.workbook, args.sheet, header, date_format)
     
+    if args.check:
+        try:
+            check(check_table(reader, text_strings, qr_string, args.icon_column,
+                args.count_column, args.index_string, config))
+        finally:
+            reader.close()
+        return
+    
+    progress = ProgressReporter() if args.progress else None
+    
+    page_cache = None
+    if args.page_cache is not None:
+        page_cache = PageCache(args.page_cache or None, args.page_cache_size * 1024 * 1024)
+    
     try:
-        make_labels_from_table(reader, text_strings, qr_string, args.icon_column, 
-            args.count_column, args.index_string, args.outfile, config)
+        outfiles = make_labels_from_table(reader, text_strings, qr_string, args.icon_column, 
+            args.count_column, args.index_string, args.outfile, config, args.skip,
+            progress=progress, jobs=args.jobs, renderer=args.renderer, 
+            pages_per_file=args.pages_per_file, start_page=args.start_page, 
+            end_page=args.end_page, page_cache=page_cache)
     
     finally:
         reader.close()
+    
+    if args.pages_per_file is not None:
+        for path in outfiles:
+            print(path)
+    
+    # Cache statistics are reported with progress and with the profile
+    report_caches = progress is not None or args.profile is not None
+    
+    if report_caches and page_cache is not None:
+        sys.stderr.write("Page cache: {0} pages reused, {1} rendered\n".format(
+            page_cache.hits, page_cache.misses))
+    
+    if report_caches and config["qr"]:
+        sys.stderr.write("QR cache: {0} hits, {1} misses\n".format(
+            qr_cache.hits, qr_cache.misses))
+    
+    if args.profile == "-":
+        sys.stderr.write(profiler.summary())
+    elif args.profile is not None:
+        profiler.write_json(args.profile)
+
+def check(problems):
+    """Print the lines of text that do not fit, and a count of each outcome."""
+    counts = dict(scaled=0, wrapped=0, truncated=0)
+    rows = set()
+    for row, line, outcome, text in problems:
+        print("Row {0}, line {1}: {2}: {3}".format(row, line, outcome, text))
+        counts[outcome] += 1
+        rows.add(row)
+    sys.stderr.write("{0} rows with text that does not fit: {1} lines scaled, "\
+        "{2} wrapped, {3} truncated\n".format(
+            len(rows), counts["scaled"], counts["wrapped"], counts["truncated"]))
+    if counts["truncated"]:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -1,16 +1,26 @@
+from collections import OrderedDict, deque
+from copy import copy
+from itertools import takewhile
+from decimal import Decimal
+import hashlib
+import json
 import math
 import os
+import pickle
+import sys
 import textwrap
-import zlib as z
 
-from .util import safe_get
+from .util import RowTemplate, profiler, safe_get, safe_map
 import labels
-from reportlab.lib import units, styles
-from reportlab.graphics import shapes
-from reportlab.graphics.barcode import qr
-from reportlab.pdfbase.pdfmetrics import stringWidth, registerFont, getTypeFace
-from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.lib import colors, units, styles
+from reportlab.lib.utils import ImageReader
+from reportlab.graphics import shapes, renderPDF
+from reportlab.pdfgen.canvas import Canvas
+from reportlab.pdfbase.pdfmetrics import registerFont, getTypeFace, getFont
+from reportlab.lib.rl_accel import unicode2T1
 #from reportlab.platypus import Frame, Paragraph
+# Modules that are only needed by some jobs (multiprocessing, QR codes, TrueType 
+# fonts, compression) are imported where they are used, to keep startup fast
 
 class DefaultLabel(object):
     """Label that places QR code (if any) at the left, lines of text (if any) on the right, and
@@ -18,15 +28,14 @@ class DefaultLabel(object):
     # More lab safety-related icons at https://pixabay.com/en/photos/danger%20sign/
     def __init__(self, text_lines=None, text_format=None, text_shrink="wrap", 
             qr_data=None, qr_format=None, icons=None, index=None, index_format=None):
+        # Formats are usually shared by every label in a job, so they are kept by
+        # reference and resolved once per job by the LabelLayout
+        self.text_format = text_format
+        self.text_shrink = text_shrink
         self.text_lines = []
         if text_lines is not None:
-            for i, line in enumerate(text_lines):
-                fmt = {}
-                if text_format is not None:
-                    for k,v in text_format.iteritems():
-                        fmt[k] = safe_get(v, i)
-                shrink = safe_get(text_shrink, i)
-                self.add_text(line, fmt, shrink)
+            for line in text_lines:
+                self.add_text(line)
         
         self.set_qr(qr_data, qr_format)
         self.icons = []
@@ -36,176 +45,1767 @@ class DefaultLabel(object):
         
         self.set_index(index, index_format)
     
-    def add_text(self, text, fmt, shrink):
+    def add_text(self, text, fmt=None, shrink=None):
+        """Add a line of text. Unless `fmt` is given, the line is formatted according 
+        to its position in the label's text_format and text_shrink."""
         self.text_lines.append((text, fmt, shrink))
     
     def set_qr(self, qr_data, qr_format):
         self.qr_data = qr_data
-        self.qr_format = qr_format or {}
+        self.qr_format = qr_format
     
     def add_icon(self, icon):
-        assert os.path.exists(icon)
-        self.icons.append(icon)
+        self.icons.append(icon_cache.get(icon))
     
     def set_index(self, index, index_format):
         self.index = index
-        self.index_format = index_format or {}
-        self.index_format["textAnchor"] = "end"
+        self.index_format = index_format
     
-    def draw(self, label, width, height, font_paths=None):
-        text_x = 0
-        max_width = width
-        max_height = height
-        icon_size = 16
+    def copies(self, indexes):
+        """Returns one label for each index string. The copies differ only in their
+        index, so the rest of the label is drawn once and shared by all of them."""
+        body = _SharedBody(self, indexes)
+        return list(LabelCopy(body, index) for index in indexes)
+    
+    def cache_key(self):
+        """Returns a value that identifies everything drawn on the label, for the
+        page cache."""
+        return (self.text_lines, self.text_format, self.text_shrink, self.qr_data,
+            self.qr_format, self.icons, self.index, self.index_format)
+    
+    def layout(self, width, height, fonts=None):
+        return get_layout(width, height, fonts, self.text_format, self.text_shrink,
+            self.qr_format, self.index_format)
+    
+    def draw(self, label, width, height, fonts=None):
+        """Draw the label. `fonts` is a FontRegistry, or a list of directories to
+        search for TrueType fonts."""
+        layout = self.layout(width, height, fonts)
+        index_width = None
+        if self.index is not None:
+            index_width = layout.index_width(self.index)
+        self.draw_body(label, width, height, fonts, index_width)
+        if self.index is not None:
+            self.draw_index(label, width, height, fonts, self.index)
+    
+    def draw_index(self, label, width, height, fonts=None, index=None):
+        """Draw an index string (by default, the label's own) in the upper right corner."""
+        if index is None:
+            index = self.index
+        layout = self.layout(width, height, fonts)
+        label.add(shapes.String(width, layout.index_y, index, **layout.index_format))
+    
+    def draw_body(self, label, width, height, fonts=None, index_width=None, 
+            outline_qr=None):
+        """Draw everything except the index. If `index_width` is not None, that much 
+        space is left free for the index in the upper right corner. If `outline_qr`
+        is True, the QR code is placed but not encoded (see `QrCache.get`); by 
+        default, it is if `label` encodes QR codes itself."""
+        layout = self.layout(width, height, fonts)
+        text_x, max_width, text_bottom = self.text_area(layout, width, index_width)
         
-        qr = None
         if self.qr_data is not None:
-            qr = make_qr(self.qr_data, **self.qr_format)
+            if outline_qr is None:
+                outline_qr = encodes_qr(label)
+            qr = qr_cache.get(self.qr_data, outline=outline_qr, 
+                **(self.qr_format or {}))[0]
             label.add(qr)
-            text_x = qr.barWidth + 1
-            max_width -= text_x
-        
-        if self.index is not None:
-            font_name, font_size = get_font(self.index_format, font_paths)
-            index_width = stringWidth(self.index, font_name, font_size)
-            max_width -= (index_width + 1)
-            index_x = width
-            index_y = height - font_size
-            label.add(shapes.String(index_x, index_y, self.index, **self.index_format))
         
         if len(self.icons) > 0:
-            icon_x = width - ((icon_size + 1) * len(self.icons))
-            icon_y = 1 # TODO: make this configurable
-            max_height -= icon_size
-            for i, icon in enumerate(self.icons):
-                label.add(shapes.Image(icon_x, icon_y, icon_size, icon_size, icon))
-                icon_x += icon_size + 1
+            icon_size = layout.icon_size
+            for icon_x, icon in zip(layout.icon_positions(len(self.icons)), self.icons):
+                label.add(shapes.Image(icon_x, layout.icon_y, icon_size, icon_size, icon))
         
         # Implementation using shapes.String
+        strings, fitted = self.fit_text(layout, height, max_width, text_bottom)
+        for style, text_y, text, font_size in strings:
+            label.add(style.string(text_x, text_y, text, font_size))
+        
+        # Implementation using platypus.Paragraph
+        # shapes and platypus are not mixable
+        #frame_width = width - text_x
+        #frame_height = height - icon_size
+        #text_frame = Frame(text_x, height, frame_width, frame_height, 
+        #    leftPadding=0, bottomPadding=0, rightPadding=0, topPadding=0)
+        #for text, fmt in self.text_lines:
+        #    style = styles.ParagraphStyle("default")
+        #    for attr, val in fmt.iteritems():
+        #        setattr(style, attr, val)
+        #    text_frame.add(Paragraph(text, style), label)
+        #label.add(text_frame)
+    
+    def text_area(self, layout, width, index_width=None):
+        """Returns the left edge, width and bottom of the space available for text."""
+        text_x = 0
+        max_width = width
+        if self.qr_data is not None:
+            text_x = layout.qr_text_x
+            max_width -= text_x
+        if index_width is not None:
+            max_width -= (index_width + 1)
+        text_bottom = 0
+        if len(self.icons) > 0:
+            text_bottom = layout.icon_size
+        return text_x, max_width, text_bottom
+    
+    def fit_text(self, layout, height, max_width, text_bottom=0):
+        """Fit the lines of text into the space available, from the top down. Returns
+        a list of (style, y, text, font_size) for the strings to draw, and a list of
+        (line number, outcome) for the lines that could not be drawn as they are: 
+        "scaled" to a smaller font size, "wrapped" onto more than one line, or 
+        "truncated" because there is no room left for them, in which case neither 
+        they nor any later lines are drawn."""
+        strings = []
+        fitted = []
         text_y = height
-        for text, fmt, shrink in self.text_lines:
-            font_name, font_size = get_font(fmt, font_paths)
+        for i, (text, fmt, shrink) in enumerate(self.text_lines):
+            if fmt is None:
+                style = layout.line_style(i)
+            else:
+                style = layout.text_style(fmt, shrink)
+            font_name = style.font_name
+            font_size = style.font_size
+            shrink = style.shrink
+            
+            if shrink == "scale":
+                # Text that would have to be smaller than the minimum size to fit
+                # is wrapped at the minimum size instead
+                scaled_size = fit_font_size(text, max_width, text_y - text_bottom, 
+                    font_name, font_size, style.min_size)
+                if scaled_size is None:
+                    font_size = style.min_size
+                    shrink = "wrap"
+                else:
+                    font_size = scaled_size
+                if font_size < style.font_size:
+                    fitted.append((i, "scaled"))
             
             if shrink == "wrap":
                 text = wrap_text(text, max_width, font_name, font_size)
+                if len(text) > 1:
+                    fitted.append((i, "wrapped"))
                 
                 if (font_size * len(text)) > text_y:
+                    fitted.append((i, "truncated"))
                     break
                 
                 for text_line in text:
                     text_y -= (font_size + 1)
-                    label.add(shapes.String(text_x, text_y, text_line, **fmt))
+                    strings.append((style, text_y, text_line, font_size))
                     
             else:
-                if shrink == "scale":
-                    font_size = scale_font_size(text, max_width, font_name, font_size)
-                    fmt["fontSize"] = font_size
-                
                 if font_size > text_y:
+                    fitted.append((i, "truncated"))
                     break
                 
                 text_y -= (font_size + 1)
-                label.add(shapes.String(text_x, text_y, text, **fmt))
+                strings.append((style, text_y, text, font_size))
         
-        # Implementation using platypus.Paragraph
-        # shapes and platypus are not mixable
-        #frame_width = width - text_x
-        #frame_height = height - icon_size
-        #text_frame = Frame(text_x, height, frame_width, frame_height, 
-        #    leftPadding=0, bottomPadding=0, rightPadding=0, topPadding=0)
-        #for text, fmt in self.text_lines:
-        #    style = styles.ParagraphStyle("default")
-        #    for attr, val in fmt.iteritems():
-        #        setattr(style, attr, val)
-        #    text_frame.add(Paragraph(text, style), label)
-        #label.add(text_frame)
+        return strings, fitted
+
+class TextStyle(object):
+    """Resolved format of a line of text."""
+    def __init__(self, fmt, shrink, fonts):
+        self.format = fmt
+        self.shrink = shrink
+        self.font_name, self.font_size = get_font(fmt, fonts)
+        self.min_size = fmt.get("minFontSize", None)
+    
+    def string(self, x, y, text, font_size=None):
+        """Create a shapes.String in this style, optionally at a different font size."""
+        string = shapes.String(x, y, text, **self.format)
+        if font_size is not None and font_size != self.font_size:
+            string.fontSize = font_size
+        return string
 
-def get_font(d, font_paths, font_key="fontName", size_key="fontSize"):
-    if font_key in d:
-        font_name = d[font_key]
-        resolved = False
+class LabelLayout(object):
+    """Positions, available space and resolved text styles for labels of the same size 
+    and formats. None of this depends on a label's content, so it is computed once per 
+    job and shared by all labels; each label only fills in its strings."""
+    icon_size = 16
+    icon_y = 1 # TODO: make this configurable
+    
+    def __init__(self, width, height, fonts=None, text_format=None, text_shrink="wrap",
+            qr_format=None, index_format=None):
+        self.width = width
+        self.height = height
+        self.fonts = fonts
+        self.text_format = text_format or {}
+        self.text_shrink = text_shrink
+        
+        qr_format = qr_format or {}
+        if "barWidth" in qr_format:
+            self.qr_width = qr_format["barWidth"]
+        else:
+            from reportlab.graphics.barcode import qr
+            self.qr_width = qr.QrCodeWidget.barWidth
+        self.qr_text_x = self.qr_width + 1
+        
+        self.index_format = dict(index_format or {}, textAnchor="end")
+        self.index_font = get_font(self.index_format, fonts)
+        self.index_y = height - self.index_font[1]
+        
+        self._lines = []
+        self._icon_positions = {}
+    
+    def index_width(self, index):
+        return text_widths.width(index, self.index_font[0], self.index_font[1])
+    
+    def line_style(self, i):
+        """Returns the TextStyle of the i'th line of text."""
+        while len(self._lines) <= i:
+            n = len(self._lines)
+            fmt = dict((k, safe_get(v, n)) for k, v in self.text_format.iteritems())
+            self._lines.append(self.text_style(fmt, safe_get(self.text_shrink, n)))
+        return self._lines[i]
+    
+    def text_style(self, fmt, shrink):
+        return TextStyle(fmt, shrink, self.fonts)
+    
+    def icon_positions(self, n):
+        """Returns the x positions of `n` icons in the lower right corner."""
+        positions = self._icon_positions.get(n, None)
+        if positions is None:
+            left = self.width - ((self.icon_size + 1) * n)
+            positions = self._icon_positions[n] = tuple(
+                left + i * (self.icon_size + 1) for i in xrange(n))
+        return positions
+
+# Layouts of recently drawn labels, keyed on the identities of their formats
+_layouts = {}
+
+def get_layout(width, height, fonts=None, text_format=None, text_shrink="wrap",
+        qr_format=None, index_format=None):
+    """Returns the LabelLayout for labels of the given size and formats. Layouts are 
+    cached on the identity of the format objects, which are shared by all of the 
+    labels in a job."""
+    refs = (fonts, text_format, text_shrink, qr_format, index_format)
+    key = (width, height) + tuple(id(ref) for ref in refs)
+    entry = _layouts.get(key, None)
+    if entry is None or any(a is not b for a, b in zip(entry[0], refs)):
+        if len(_layouts) >= 16:
+            _layouts.clear()
+        layout = LabelLayout(width, height, fonts, text_format, text_shrink, 
+            qr_format, index_format)
+        entry = _layouts[key] = (refs, layout)
+    return entry[1]
+
+class FontRegistry(object):
+    """Resolves font names to fonts registered with reportlab. Fonts that are not 
+    already registered are looked for as TrueType files in `font_paths`. Both hits and
+    misses are cached, so each font is only looked up once per job."""
+    def __init__(self, font_paths=None):
+        """
+        font_paths -- list of directories to search for <font name>.ttf files
+        """
+        self.font_paths = font_paths
+        self._resolved = {}
+        self._handles = {}
+    
+    def __getstate__(self):
+        # Fonts are registered per process, so lookups are not carried over
+        return dict(font_paths=self.font_paths)
+    
+    def __setstate__(self, state):
+        self.__init__(state["font_paths"])
+    
+    def resolve(self, font_name):
+        """Returns font_name if the font can be used, otherwise raises an Exception."""
+        if font_name not in self._resolved:
+            self._resolved[font_name] = self._find(font_name)
+        if not self._resolved[font_name]:
+            raise Exception("Could not locate font {0}".format(font_name))
+        return font_name
+    
+    def validate(self, fmt, font_key="fontName"):
+        """Resolve the font(s) named in a format dict, in which the font name may be a
+        single value or a list with one value per line."""
+        if font_key in fmt:
+            names = fmt[font_key]
+            if not isinstance(names, (list, tuple)):
+                names = (names,)
+            for name in names:
+                self.resolve(name)
+    
+    def get_font(self, d, font_key="fontName", size_key="fontSize"):
+        """Returns the (font_name, font_size) handle for a format dict."""
+        key = (d.get(font_key, None), d.get(size_key, None))
+        handle = self._handles.get(key, None)
+        if handle is None:
+            if key[0] is None:
+                font_name = shapes.STATE_DEFAULTS["fontName"]
+            else:
+                font_name = self.resolve(key[0])
+            font_size = shapes.STATE_DEFAULTS["fontSize"] if key[1] is None else key[1]
+            handle = self._handles[key] = (font_name, font_size)
+        return handle
+    
+    def _find(self, font_name):
         try:
             getTypeFace(font_name)
-            resolved = True
-            
-        except:
-            if font_paths is not None:
-                for path in font_paths:
-                    try:
-                        registerFont(TTFont(font_name, os.path.join(path, "{0}.ttf".format(font_name))))
-                        resolved = True
-                        break
-                    except:
-                        pass
-        
-        if not resolved:
-            raise Exception("Could not locate font {0}".format(font_name))
+            return True
+        except Exception:
+            pass
+        
+        if self.font_paths is not None:
+            for path in self.font_paths:
+                font_file = os.path.join(path, "{0}.ttf".format(font_name))
+                if not os.path.exists(font_file):
+                    continue
+                try:
+                    from reportlab.pdfbase.ttfonts import TTFont
+                    registerFont(TTFont(font_name, font_file))
+                    return True
+                except Exception:
+                    pass
+        
+        return False
+
+# Registries used by get_font when given a list of font paths
+_font_registries = {}
+
+class LabelCopy(object):
+    """One of several copies of a label that differ only in their index."""
+    def __init__(self, body, index):
+        self.body = body
+        self.index = index
     
-    else:
-        font_name = shapes.STATE_DEFAULTS["fontName"]
+    def cache_key(self):
+        # The space left for the index depends on all of the copies' indexes
+        return (self.body.cache_key(), self.body.indexes, self.index)
+    
+    def draw(self, label, width, height, fonts=None):
+        label.add(self.body.draw(width, height, fonts, encodes_qr(label)))
+        self.body.label.draw_index(label, width, height, fonts, self.index)
+
+class _SharedBody(object):
+    """The body of a label, drawn the first time it is needed and then reused as a 
+    LabelForm, so that it is rendered into the PDF only once. Space is left for the 
+    widest of the copies' index strings."""
+    def __init__(self, label, indexes):
+        self.label = label
+        self.indexes = indexes
+        self.group = None
+        self.size = None
+        self.key = None
+    
+    def cache_key(self):
+        if self.key is None:
+            self.key = self.label.cache_key()
+        return self.key
+    
+    def form_name(self, width, height, outline_qr):
+        """Name the form after everything that is drawn on it, so that the output 
+        does not depend on the order or the process in which bodies are drawn, and
+        identical bodies share a form."""
+        data = json.dumps((self.cache_key(), self.indexes, width, height, outline_qr), 
+            sort_keys=True, default=repr)
+        return "LabelBody" + hashlib.sha1(data.encode("utf-8")).hexdigest()[:16]
+    
+    def draw(self, width, height, fonts=None, outline_qr=False):
+        if self.group is None or self.size != (width, height, outline_qr):
+            layout = self.label.layout(width, height, fonts)
+            index_width = max(layout.index_width(index) for index in self.indexes)
+            self.group = LabelForm(self.form_name(width, height, outline_qr), width, height)
+            self.label.draw_body(self.group, width, height, fonts, index_width, 
+                outline_qr)
+            self.size = (width, height, outline_qr)
+        return self.group
+
+class LabelForm(shapes.Group):
+    """Group of shapes that PDF renderers (_SheetRenderer and CanvasLabel) render
+    once per file, as a form XObject that is then drawn wherever the group is used.
+    Any other renderer draws it as an ordinary group."""
+    def __init__(self, name, width, height):
+        """
+        name          -- name of the form; groups with the same name must have the
+                         same contents
+        width, height -- size of the form; shapes outside it are not drawn
+        """
+        shapes.Group.__init__(self)
+        # Bypasses attribute validation, as QrPath does
+        self.__dict__["form_name"] = name
+        self.__dict__["form_size"] = (float(width), float(height))
+    
+    def draw_form(self, canvas, draw_contents):
+        """Draw the form onto a pdfgen canvas, first defining it if it is not yet in
+        the canvas' document. `draw_contents` draws the group's shapes onto the 
+        canvas."""
+        if not canvas.hasForm(self.form_name):
+            canvas.beginForm(self.form_name, 0, 0, *self.form_size)
+            draw_contents()
+            canvas.endForm()
+        canvas.doForm(self.form_name)
+
+def encodes_qr(label):
+    """Whether the surface that a label is drawn on encodes QR codes itself, so that
+    codes only need to be placed on it (see `QrCache.get`)."""
+    return getattr(label, "encodes_qr", False)
+
+class LabelFields(object):
+    """The compiled templates and formats that make a job's labels from the rows of
+    its table. One is shared by all of the labels in a job."""
+    def __init__(self, text_templates=None, text_format=None, text_shrink="wrap",
+            qr_template=None, qr_format=None, icon_key=None, icon_paths=None, 
+            count_key=None, index_template=None, index_format=None):
+        """
+        text_templates -- RowTemplates for the lines of text
+        qr_template    -- RowTemplate for the data to encode in the QR code
+        icon_key       -- row key of the icon codes; `icon_paths` maps each code
+                          to the path of an image file
+        count_key      -- row key of the number of copies of each label
+        index_template -- RowTemplate for the label index
+        The formats are the same as for DefaultLabel.
+        """
+        self.text_templates = text_templates
+        self.text_format = text_format
+        self.text_shrink = text_shrink
+        self.qr_template = qr_template
+        self.qr_format = qr_format
+        self.icon_key = icon_key
+        self.icon_paths = icon_paths
+        self.count_key = count_key
+        self.index_template = index_template
+        self.index_format = index_format
+    
+    def count(self, row):
+        return 1 if self.count_key is None else int(row[self.count_key])
+    
+    def shared_copies(self):
+        """Whether the copies of a label differ only in their index, i.e. the text 
+        and QR code do not depend on the index."""
+        if self.index_template is None:
+            return False
+        for template in tuple(self.text_templates or ()) + (self.qr_template,):
+            if template is not None and "_index_" in template.fields:
+                return False
+        return True
+    
+    def extras(self, row, index=1):
+        """Returns the values of the extra template fields for a copy of a row."""
+        return dict(_index_=index, _count_=self.count(row))
+    
+    def text(self, row, extras):
+        if self.text_templates is None:
+            return None
+        return tuple(t.format(row, extras) for t in self.text_templates)
+    
+    def qr_data(self, row, extras):
+        return None if self.qr_template is None else self.qr_template.format(row, extras)
+    
+    def icons(self, row):
+        # Translate the icon codes into paths to image files
+        if self.icon_key is None:
+            return ()
+        return tuple(self.icon_paths[i] for i in row[self.icon_key])
+    
+    def index(self, row, extras):
+        if self.index_template is None:
+            return None
+        return self.index_template.format(row, extras)
+    
+    def make_label(self, label_class, row, extras):
+        """Create a label of `label_class`, which has the same constructor signature
+        as DefaultLabel."""
+        return label_class(self.text(row, extras), self.text_format, self.text_shrink, 
+            self.qr_data(row, extras), self.qr_format, self.icons(row), 
+            self.index(row, extras), self.index_format)
+
+class CompactLabel(object):
+    """Label that keeps only its row, its copy index, and the LabelFields shared by 
+    every label in the job. Its text, QR data, icons and index are formatted from 
+    the row each time it is drawn, so it takes much less memory than a DefaultLabel
+    while it waits to be drawn, e.g. in the shards of a job with several processes. 
+    Pass it as make_labels_from_table's `label_class`, which makes labels with 
+    `from_row` rather than the DefaultLabel constructor."""
+    __slots__ = ("fields", "row", "copy")
+    
+    def __init__(self, fields, row, copy=1):
+        self.fields = fields
+        self.row = row
+        self.copy = copy
+    
+    @classmethod
+    def from_row(cls, fields, row, copy=1):
+        return cls(fields, row, copy)
+    
+    def __getstate__(self):
+        return (self.fields, self.row, self.copy)
     
-    font_size = d.get(size_key, shapes.STATE_DEFAULTS["fontSize"])
-    return (font_name, font_size)
+    def __setstate__(self, state):
+        self.fields, self.row, self.copy = state
+    
+    def label(self):
+        """Returns the DefaultLabel that this label draws."""
+        fields = self.fields
+        return fields.make_label(DefaultLabel, self.row, fields.extras(self.row, self.copy))
+    
+    def copies(self, indexes):
+        body = _SharedBody(self, indexes)
+        return list(LabelCopy(body, index) for index in indexes)
+    
+    def cache_key(self):
+        return self.label().cache_key()
+    
+    def layout(self, width, height, fonts=None):
+        fields = self.fields
+        return get_layout(width, height, fonts, fields.text_format, fields.text_shrink,
+            fields.qr_format, fields.index_format)
+    
+    def draw(self, label, width, height, fonts=None):
+        self.label().draw(label, width, height, fonts)
+    
+    def draw_body(self, label, width, height, fonts=None, index_width=None, 
+            outline_qr=None):
+        self.label().draw_body(label, width, height, fonts, index_width, outline_qr)
+    
+    def draw_index(self, label, width, height, fonts=None, index=None):
+        # Copies of a label are drawn with their index, so only the index is 
+        # formatted, and only if it is not given
+        if index is None:
+            fields = self.fields
+            index = fields.index(self.row, fields.extras(self.row, self.copy))
+        layout = self.layout(width, height, fonts)
+        label.add(shapes.String(width, layout.index_y, index, **layout.index_format))
+
+def get_font(d, fonts, font_key="fontName", size_key="fontSize"):
+    """Returns (font_name, font_size) for a format dict. `fonts` is a FontRegistry, or
+    a list of directories to search for TrueType fonts."""
+    if not isinstance(fonts, FontRegistry):
+        key = None if fonts is None else tuple(fonts)
+        if key not in _font_registries:
+            _font_registries[key] = FontRegistry(fonts)
+        fonts = _font_registries[key]
+    return fonts.get_font(d, font_key, size_key)
+
+class TextWidths(object):
+    """Measures strings, giving the same widths as reportlab's stringWidth. Widths are
+    added up from a table of the advance widths of each font's glyphs, which is
+    filled in as characters are first seen, and the width of each string is kept, so
+    that strings that are measured again (such as common words, spaces and index 
+    strings) are only looked up. Widths are kept in font units, so a string measured
+    at one size does not have to be measured again at another."""
+    def __init__(self, maxsize=100000):
+        """
+        maxsize -- maximum number of strings to keep the widths of
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._fonts = {}
+        self._widths = {}
+    
+    def width(self, text, font_name, font_size):
+        """Returns the width of `text` in a font, in points."""
+        key = (font_name, text)
+        units = self._widths.get(key, None)
+        if units is None:
+            self.misses += 1
+            units = self._measure(text, font_name)
+        else:
+            self.hits += 1
+        return self._scale(units, font_name, font_size)
+    
+    def widths(self, texts, font_name, font_size):
+        """Returns the widths of a list of strings in the same font."""
+        return list(self.width(text, font_name, font_size) for text in texts)
+    
+    def clear(self):
+        self._fonts.clear()
+        self._widths.clear()
+        self.hits = self.misses = 0
+    
+    def _scale(self, units, font_name, font_size):
+        # In the same order of operations as reportlab, to give identical results
+        if self._fonts[font_name][1]:
+            return 0.001 * font_size * units
+        return units * 0.001 * font_size
+    
+    def _measure(self, text, font_name):
+        glyphs = self._fonts.get(font_name, None)
+        if glyphs is None:
+            font = getFont(font_name)
+            # TrueType fonts have a face with a width for each character; Type 1 
+            # fonts have a width for each byte of their encoding
+            truetype = hasattr(getattr(font, "face", None), "charWidths")
+            glyphs = self._fonts[font_name] = (font, truetype, {})
+        font, truetype, table = glyphs
+        
+        chars = text.decode("utf-8") if isinstance(text, bytes) else text
+        units = 0
+        for char in chars:
+            width = table.get(char, None)
+            if width is None:
+                width = table[char] = self._glyph_width(font, truetype, char)
+            units += width
+        
+        if len(self._widths) >= self.maxsize:
+            self._widths.clear()
+        self._widths[(font_name, text)] = units
+        return units
+    
+    def _glyph_width(self, font, truetype, char):
+        if truetype:
+            return font.face.charWidths.get(ord(char), font.face.defaultWidth)
+        # Characters that are not in the font's encoding are taken from its 
+        # substitution fonts, as reportlab does
+        return sum(sum(f.widths[b] for b in bytearray(encoded)) 
+            for f, encoded in unicode2T1(char, [font] + font.substitutionFonts))
 
+# Text widths are shared by all labels in a run
+text_widths = TextWidths()
+
+@profiler.timed("wrap")
 def wrap_text(text, max_width, font_name="Helvetica", font_size=50):
-    text_width = stringWidth(text, font_name, font_size)
-    nchar = len(text)
-    new_text = [text]
-    while text_width > max_width:
-        nchar -= 1
-        new_text = textwrap.wrap(text, nchar)
-        text_width = max(stringWidth(t, font_name, font_size) for t in new_text)
-    return new_text
-
-def scale_font_size(text, max_width, font_name="Helvetica", font_size=50, scaling=0.8):
-    """Measure the width of the text and shrink the font size until it fits."""
-    text_width = stringWidth(text, font_name, font_size)
-    while text_width > max_width:
-        font_size *= scaling
-        text_width = stringWidth(text, font_name, font_size)
+    """Break text into the longest lines, by number of characters, that are no 
+    wider than max_width. Lines are broken by textwrap, at spaces and hyphens. 
+    
+    No line longer than max_width divided by the width of the narrowest character 
+    in the text can fit, so that is the first line length tried. Wrapping text to 
+    n characters per line gives the same lines for every n down to the length of 
+    the longest line, so the next length tried is one less than the longest line 
+    of the last attempt. The number of attempts depends on max_width rather than 
+    on the length of the text. The text is split into chunks once, and each 
+    attempt wraps the same chunks, as textwrap.wrap does."""
+    if text_widths.width(text, font_name, font_size) <= max_width:
+        return [text]
+    
+    wrapper = textwrap.TextWrapper()
+    munged = wrapper._munge_whitespace(text)
+    chunks = wrapper._split(munged)
+    nchar = len(text) - 1
+    narrowest = min(text_widths.width(c, font_name, font_size) for c in set(munged))
+    if narrowest > 0:
+        # One more, in case of rounding in the sum of the widths
+        nchar = min(nchar, int(max_width / narrowest) + 1)
+    while True:
+        wrapper.width = nchar
+        lines = wrapper._wrap_chunks(list(chunks))
+        if all(text_widths.width(line, font_name, font_size) <= max_width 
+                for line in lines):
+            return lines
+        nchar = max(len(line) for line in lines) - 1
+
+@profiler.timed("fit")
+def fit_font_size(text, max_width, max_height=None, font_name="Helvetica", font_size=50,
+        min_size=None):
+    """Find the largest font size, no larger than font_size, at which the text fits 
+    within max_width and max_height. Text width is proportional to font size, so a 
+    single measurement is enough. Returns None if the text would have to be smaller 
+    than min_size to fit."""
+    text_width = text_widths.width(text, font_name, font_size)
+    if text_width > max_width:
+        font_size *= float(max(max_width, 0)) / text_width
+    if max_height is not None and font_size > max_height:
+        font_size = max(max_height, 0)
+    if min_size is not None and font_size < min_size:
+        return None
     return font_size
 
-def make_labels(specs, label_list, outfile, skip=0, draw_border=True, font_paths=None):
-    """Make labels for a given set of Label objects."""
+def table_fields(reader, text_strings, qr_string, icon_column, count_column, index_string,
+        config):
+    """Compile the templates of a job against the columns of a table, so that unknown
+    columns are reported before any labels are made, and resolve the formats of its 
+    labels from the config. Arguments are the same as for `make_labels_from_table`.
+    Returns a LabelFields."""
+    # Compute the number of points available for drawing/printing.
+    specs = config["spec"]
+    height = float(specs._label_height - (specs._top_padding + specs._bottom_padding)) * units.mm
+    
+    text_format = None
+    text_shrink = "wrap"
+    if config.get("text"):
+        text_format = config["text"].get("format", {})
+        text_shrink = config["text"].get("shrink", "wrap")
+
+        if "alignment" in text_format:
+            # shapes version
+            aln_map = dict(
+                left="start",
+                center="middle",
+                right="end",
+                justify="start" # no justify option
+            )
+            text_format["textAnchor"] = safe_map(lambda a: aln_map[a], text_format["alignment"])
+                        
+            # Platypus version
+            # have to map alignment strings to enums
+            #aln_map = dict(
+            #    left=enums.TA_LEFT,
+            #    center=enums.TA_CENTER,
+            #    right=enums.TA_RIGHT,
+            #    justify=enums.TA_JUSTIFY
+            #)
+            #text_format["alignment"] = safe_map(lambda a: aln_map[a], text_format["alignment"])
+    
+    qr_format = None
+    if config.get("qr"):
+        compress = config["qr"]["compress"]
+        if "cacheSize" in config["qr"]:
+            qr_cache.resize(config["qr"]["cacheSize"])
+        qr_format = config["qr"].get("format", {})
+        # by default, set the QR to be square, with both sides equal
+        # to the usable height of the label
+        if "barWidth" not in qr_format:
+            qr_format["barWidth"] = qr_format.get("barHeight", height)
+        if "barHeight" not in qr_format:
+            qr_format["barHeight"] = qr_format["barWidth"]
+    
+    index_format = None
+    if "index" in config and count_column is not None:
+        if index_string is None:
+            index_string = config["index"].get("default", "{_index_} / {_count_}")
+        index_format = config["index"].get("format", {})
+    else:
+        index_string = None
+    
+    # Compile the templates against the columns of the table, so that unknown
+    # columns are reported before any labels are made
+    extra_fields = ("_index_", "_count_")
+    if hasattr(reader, "select"):
+        # Only read the columns that are used
+        columns = set(c for c in (icon_column, count_column) if c is not None)
+        for template in tuple(text_strings or ()) + (qr_string, index_string):
+            if template is not None:
+                columns.update(RowTemplate(template, None, extra_fields).fields)
+        columns.difference_update(extra_fields)
+        try:
+            reader.select(columns)
+        except KeyError as e:
+            raise Exception("Unknown column {0}".format(e.args[0]))
+    
+    column_key = getattr(reader, "column_key", None)
+    def compile_template(template):
+        return RowTemplate(template, column_key, extra_fields)
+    def resolve_column(name):
+        try:
+            return name if column_key is None else column_key(name)
+        except KeyError:
+            raise Exception("Unknown column {0}".format(name))
+    
+    text_templates = None
+    if text_strings is not None:
+        text_templates = tuple(compile_template(t) for t in text_strings)
+    qr_template = None if qr_string is None else compile_template(qr_string)
+    index_template = None if index_string is None else compile_template(index_string)
+    icon_key = None
+    if icon_column is not None and "icons" in config:
+        icon_key = resolve_column(icon_column)
+    count_key = None if count_column is None else resolve_column(count_column)
+    return LabelFields(text_templates, text_format, text_shrink, qr_template, 
+        qr_format, icon_key, config.get("icons", None), count_key, index_template,
+        index_format)
+
+def make_labels_from_table(reader, text_strings, qr_string, icon_column, count_column, index_string,
+        outfile, config, skip=0, label_class=DefaultLabel, progress=None, jobs=1,
+        renderer="drawing", pages_per_file=None, start_page=1, end_page=None,
+        page_cache=None):
+    """Create one label for each row in a table.
+
+    Labels are created lazily as rows are read, and each page is written out as soon
+    as it is full, so memory use stays flat regardless of the size of the table.
+
+    Keyword arguments:
+    reader       -- reader that returns a row for each row of a table, such as a 
+                   CsvReader. If the reader has a `column_key` method, it is used to 
+                   resolve column names to row keys, and if it has a `select` method,
+                   only the columns that are used are read.
+    text_string  -- tuple of strings for the lines of text on the labels.
+    qr_string    -- string to be encoded in the QR code.
+    icon_column  -- name of column with icons to be shown on the label.
+    count_column -- name of column with count of containers
+    index_string -- string showing the label index
+    outfile      -- PDF file to write, or the base name of the files to write if 
+                   `pages_per_file` is given
+    config       -- dict with configuration information; the result of calling `get_config`
+    label_class  -- Object type to create for each label; must have same constructor
+                   signature as DefaultLabel, or a `from_row` class method with the
+                   same signature as CompactLabel's
+    progress     -- ProgressReporter (or any object with `row` and `page` methods) that
+                   is notified as rows are read and pages are written
+    jobs         -- number of processes to use for drawing labels
+    renderer     -- "drawing", "canvas" or "zpl"; see `make_labels`. The "zpl" 
+                   renderer uses the "printer" section of the config.
+    pages_per_file, start_page, end_page -- split and limit the output; see `make_labels`
+    page_cache   -- PageCache of previously rendered pages; see `make_labels`
+    
+    Returns the paths of the files written.
+    """
+    
+    specs = config["spec"]
+    fields = table_fields(reader, text_strings, qr_string, icon_column, count_column,
+        index_string, config)
+    qr_format = fields.qr_format
+    
+    qr_batch = []
+    from_row = getattr(label_class, "from_row", None)
+    def make_label(row, extras):
+        if prefetch_qr:
+            qr_batch.append(fields.qr_data(row, extras))
+        if from_row is not None:
+            return from_row(fields, row, extras["_index_"])
+        return fields.make_label(label_class, row, extras)
+    
+    def make_copies(row, extras):
+        # Create the label once; the copies only differ in their index
+        label = make_label(row, extras)
+        indexes = []
+        for i in xrange(extras["_count_"]):
+            extras["_index_"] = i + 1
+            indexes.append(fields.index(row, extras))
+        return label.copies(indexes)
+    
+    # If the text and QR code do not depend on the index, each row is only drawn 
+    # once, no matter how many copies are needed
+    shared_copies = fields.shared_copies() and hasattr(label_class, "copies")
+    
+    def row_labels(row):
+        if progress is not None:
+            progress.row()
+        extras = fields.extras(row)
+        count = extras["_count_"]
+        if shared_copies and count > 1:
+            for label in make_copies(row, extras):
+                yield label
+        else:
+            for i in xrange(count):
+                extras["_index_"] = i + 1
+                yield make_label(row, extras)
+    
+    # When labels are drawn as soon as they are made, the QR codes for a batch of 
+    # rows are encoded together, and are then found in the cache when the labels 
+    # are drawn. Workers and the page cache draw labels later (or not at all), and
+    # when only a range of pages is written, most labels are never drawn. Printers
+    # that are sent ZPL encode the codes themselves.
+    prefetch_qr = (fields.qr_template is not None and jobs == 1 and page_cache is None 
+        and start_page <= 1 and end_page is None and renderer != "zpl"
+        and qr_cache.maxsize > 0 and hasattr(reader, "batches"))
+    
+    def iter_labels():
+        if not prefetch_qr:
+            for row in reader:
+                for label in row_labels(row):
+                    yield label
+            return
+        
+        for rows in reader.batches(qr_cache.maxsize):
+            labels = []
+            for row in rows:
+                labels.extend(row_labels(row))
+            qr_cache.prefetch(qr_batch, **qr_format)
+            del qr_batch[:]
+            for label in labels:
+                yield label
+    
+    # Generate the PDF for the labels
+    return make_labels(specs, iter_labels(), outfile, skip, 
+        config.get("borders", True), config["fonts"], progress, jobs, 
+        renderer=renderer, pages_per_file=pages_per_file, start_page=start_page,
+        end_page=end_page, page_cache=page_cache, printer=config.get("printer", None))
+
+def check_table(reader, text_strings, qr_string, icon_column, count_column, index_string,
+        config):
+    """Measure the text of each label that would be made from a table against the
+    layout, without drawing anything. Arguments are the same as for 
+    `make_labels_from_table`. Yields (row number, line number, outcome, text) for 
+    each line of text that would be "scaled", "wrapped" or "truncated" (see 
+    `DefaultLabel.fit_text`); rows and lines are numbered from 1, not counting the 
+    header row."""
+    specs = config["spec"]
+    width = float(specs._label_width - (specs._left_padding + specs._right_padding)) * units.mm
+    height = float(specs._label_height - (specs._top_padding + specs._bottom_padding)) * units.mm
+    fields = table_fields(reader, text_strings, qr_string, icon_column, count_column,
+        index_string, config)
+    shared_copies = fields.shared_copies()
+    
+    for row_number, row in enumerate(reader, 1):
+        count = fields.count(row)
+        if count < 1:
+            # No labels are made for the row
+            continue
+        labels = list(fields.make_label(DefaultLabel, row, fields.extras(row, i + 1))
+            for i in xrange(1 if shared_copies else count))
+        layout = labels[0].layout(width, height, config["fonts"])
+        index_width = None
+        if shared_copies:
+            # Space is left for the widest of the copies' indexes
+            index_width = max(layout.index_width(fields.index(row, fields.extras(row, i + 1)))
+                for i in xrange(count))
+        
+        reported = set()
+        for label in labels:
+            if not shared_copies and label.index is not None:
+                index_width = layout.index_width(label.index)
+            text_x, max_width, text_bottom = label.text_area(layout, width, index_width)
+            for line, outcome in label.fit_text(layout, height, max_width, text_bottom)[1]:
+                if (line, outcome) not in reported:
+                    reported.add((line, outcome))
+                    yield row_number, line + 1, outcome, label.text_lines[line][0]
+
+@profiler.timed("config")
+def prepare_config(label_config, page_config):
+    """Prepare configuration information from two JSON config files: labels and specs.
+    
+    Keyword arguments:
+    label_config -- JSON file with configuration information 
+                    for a specific set of labels.
+    page_config  -- JSON file with configuration information 
+                    with layouts of standard label types.
+    """
+    # TODO: exceptions will be raised if any expected keys are missing;
+    # do explicit validation and raise custom exceptions
+    
+    # The 'spec' config entry tells us which spec to use
+    spec_config = label_config["spec"]
+    # Select the requested spec from the spec config
+    page_type, spec_args = page_config["label"][spec_config["name"]]
+    # Resolve the page type into width and height
+    spec_args["sheet_width"], spec_args["sheet_height"] = page_config["page"][page_type]
+    # Padding may be specified in the config; if so, transfer to the spec
+    for side in ('top','bottom','left','right'):
+        key = "{0}_padding".format(side)
+        if key in spec_config:
+            spec_args[key] = spec_config[key]
+    # Convert all spec values to arbitrary precision, to prevent
+    # rounding errors
+    spec_args = dict((k, Decimal(v)) for k,v in spec_args.items())
+    spec = labels.Specification(**spec_args)
+    label_config["spec"] = spec
+    
+    text = False
+    if "text" in label_config:
+        text = label_config["text"]
+        if "lines" not in text:
+            # Use one line of text by default
+            text["lines"] = 1
+    label_config["text"] = text
+    
+    qr = False
+    if "qr" in label_config:
+        qr = label_config["qr"]
+        if "compress" not in qr:
+            # Do not compress QR code data by default
+            qr["compress"] = False
+    label_config["qr"] = qr
+    
+    if "fontPath" in label_config:
+        label_config["fontPath"] = list(
+            os.path.abspath(os.path.expanduser(path)) for path in label_config["fontPath"])
+    
+    # Resolve every font named in the config up front, so that a missing
+    # font is reported before any labels are drawn
+    fonts = FontRegistry(label_config.get("fontPath", None))
+    for section in ("text", "index"):
+        if label_config.get(section):
+            fonts.validate(label_config[section].get("format", {}))
+    label_config["fonts"] = fonts
+    
+    if "icons" in label_config:
+        icon_cache.load(label_config["icons"].values())
+
+    return label_config
+
+# The page config that comes with labelmaker
+DEFAULT_PAGE_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 
+    "config", "page-config.json")
+
+# Increment when a change to prepare_config changes the configs it returns
+CONFIG_CACHE_VERSION = 1
+
+def read_config(label_config_file, page_config_file=None, cache_dir=None):
+    """Read label and page config files and prepare them with `prepare_config`. By 
+    default, the page config that comes with labelmaker is used.
+    
+    If `cache_dir` is given, the prepared config is pickled to a file in that 
+    directory, and is loaded from there as long as neither config file has changed.
+    """
+    if page_config_file is None:
+        page_config_file = DEFAULT_PAGE_CONFIG
+    
+    if cache_dir is not None:
+        cache_file, stamp = _config_cache_entry(cache_dir, label_config_file, page_config_file)
+        config = _load_cached_config(cache_file, stamp)
+        if config is not None:
+            return config
+    
+    with open(label_config_file, "rU") as i:
+        label_config = json.load(i)
+    with open(page_config_file, "rU") as i:
+        page_config = json.load(i)
+    config = prepare_config(label_config, page_config)
+    
+    if cache_dir is not None:
+        _save_cached_config(cache_file, stamp, config)
+    return config
+
+def _config_cache_entry(cache_dir, *config_files):
+    """Returns the path of the cache file for a set of config files, and a stamp
+    that changes whenever any of them does."""
+    paths = list(os.path.abspath(f) for f in config_files)
+    name = hashlib.sha1(repr(paths).encode("utf-8")).hexdigest()
+    cache_file = os.path.join(os.path.expanduser(cache_dir), name + ".pickle")
+    stamp = [CONFIG_CACHE_VERSION, tuple(sys.version_info[:2])]
+    for path in paths:
+        st = os.stat(path)
+        stamp.append((path, st.st_mtime, st.st_size))
+    return cache_file, stamp
+
+@profiler.timed("config")
+def _load_cached_config(cache_file, stamp):
+    """Returns the cached config, or None if there is no cached config or it is out
+    of date."""
+    if not os.path.exists(cache_file):
+        return None
+    try:
+        with open(cache_file, "rb") as i:
+            cached_stamp, config = pickle.load(i)
+    except Exception:
+        # An unreadable cache file is the same as a missing one
+        return None
+    if cached_stamp != stamp:
+        return None
+    # Icons are loaded when a config is prepared; fonts are registered when first used
+    if "icons" in config:
+        icon_cache.load(config["icons"].values())
+    return config
+
+def _save_cached_config(cache_file, stamp, config):
+    cache_dir = os.path.dirname(cache_file)
+    tmp = "{0}.{1}.tmp".format(cache_file, os.getpid())
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        with open(tmp, "wb") as o:
+            pickle.dump((stamp, config), o, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, cache_file)
+    except (IOError, OSError):
+        # The cache is only an optimization, so a read-only cache directory is ignored
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def default_templates(config, text_strings=None, qr_string=None):
+    """Returns the text and QR code templates for a job. By default, the text lines are
+    the first N columns, where N is the number of lines in the config, and the QR code
+    encodes the first line of text."""
+    if config["text"] and config["text"]["lines"] > 0:
+        if text_strings is None:
+            text_strings = list("{{col{0}}}".format(i+1) for i in xrange(config["text"]["lines"]))
+        elif len(text_strings) != config["text"]["lines"]:
+            raise Exception("Expected {0} text strings, got {1}".format(
+                config["text"]["lines"], len(text_strings)))
+    else:
+        text_strings = None
+    
+    if config["qr"]:
+        qr_string = qr_string or text_strings[0] if text_strings is not None else "{col1}"
+    else:
+        qr_string = None
+    
+    return text_strings, qr_string
+
+class _SheetRenderer(renderPDF._PDFRenderer):
+    """PDF renderer that draws images as external objects, which are stored once in
+    the PDF no matter how many times they are drawn, rather than inline at every use."""
+    def drawImage(self, image):
+        self._canvas.drawImage(image.path, image.x, image.y, image.width, image.height)
+    
+    def drawGroup(self, group):
+        if isinstance(group, LabelForm):
+            def draw_contents():
+                # The form is drawn by a renderer of its own, which sets every part
+                # of the graphics state it uses, so that the form looks the same 
+                # wherever it is drawn
+                drawing = shapes.Drawing(*group.form_size)
+                drawing.contents = group.contents
+                outer = self._canvas._drawing
+                _SheetRenderer().draw(drawing, self._canvas, 0, 0)
+                self._canvas.__dict__["_drawing"] = outer
+            group.draw_form(self._canvas, draw_contents)
+        else:
+            renderPDF._PDFRenderer.drawGroup(self, group)
+    
+    def drawPath(self, path):
+        # A QrPath is drawn as rectangles, which take less space in the PDF
+        rects = getattr(path, "rects", None)
+        if rects is None:
+            return renderPDF._PDFRenderer.drawPath(self, path)
+        pdf_path = self._canvas.beginPath()
+        for x, y, width, height in rects:
+            pdf_path.rect(x, y, width, height)
+        self._canvas.drawPath(pdf_path, stroke=0, fill=self._fill)
+
+class PageRange(object):
+    """Pages `start` to `end` (inclusive, one-based), or from `start` onwards if `end`
+    is None. Used as a Sheet's `pages_to_draw`, where only membership is tested."""
+    def __init__(self, start=1, end=None):
+        self.start = start
+        self.end = end
+    
+    def __contains__(self, page):
+        return page >= self.start and (self.end is None or page <= self.end)
+    
+    def __nonzero__(self):
+        return True
+    
+    __bool__ = __nonzero__
+    
+    def after(self, page):
+        """Whether `page` is past the end of the range."""
+        return self.end is not None and page > self.end
+
+def chunk_path(outfile, chunk, default_ext=".pdf"):
+    """Returns the path of the `chunk`th (one-based) file of a chunked job, 
+    e.g. labels-003.pdf for outfile labels.pdf."""
+    root, ext = os.path.splitext(outfile)
+    return "{0}-{1:03d}{2}".format(root, chunk, ext or default_ext)
+
+class StreamingOutput(object):
+    """Base for sheets that write each page as soon as it is finished, to one file or 
+    to a numbered series of files of at most `pages_per_file` pages (see 
+    `chunk_path`). Subclasses open the file for the current page in `_open_file`,
+    close it in `_close_file`, and finish the last page in `_finish`."""
+    def _file_chunk(self):
+        """Returns the number (one-based) of the file the current page goes in."""
+        if self.pages_per_file is None:
+            return 1
+        return (self.page_count - 1) // self.pages_per_file + 1
+    
+    @profiler.timed("save")
+    def save(self, filelike=None):
+        """Finish the last page and close the output file. The output file is
+        fixed when the sheet is created, so `filelike` is ignored."""
+        self._finish()
+        if not self.outfiles and self.pages_per_file is None:
+            # Always write the output file, even if it has no labels
+            self._open_file()
+        self._close_file()
+
+class StreamingSheet(StreamingOutput, labels.Sheet):
+    """Sheet that renders each page onto the output canvas as soon as it is full,
+    rather than holding every page in memory until save() is called. Output can be
+    split into a numbered series of files of at most `pages_per_file` pages, each of
+    which is closed as soon as it is full, and can be limited to a range of pages."""
+    def __init__(self, specification, drawing_callable, outfile, progress=None, 
+            pages_per_file=None, start_page=1, end_page=None, **kwargs):
+        """
+        outfile        -- path of the PDF file to write, or the base name of the files
+                          to write if `pages_per_file` is given (see `chunk_path`)
+        progress       -- object whose `page` method is called with the page count 
+                          each time a page is written
+        pages_per_file -- maximum number of pages in each file
+        start_page     -- first page to write (one-based); labels on earlier pages 
+                          take up their positions, but are not drawn
+        end_page       -- last page to write, or None to write every page
+        kwargs         -- passed through to labels.Sheet
+        """
+        labels.Sheet.__init__(self, specification, drawing_callable, 
+            pages_to_draw=PageRange(start_page, end_page), **kwargs)
+        self.outfile = outfile
+        self.pages_per_file = pages_per_file
+        self.outfiles = []
+        self.canvas = None
+        self.progress = progress
+        self._chunk = None
+    
+    @property
+    def done(self):
+        """Whether all the pages to be written have been laid out."""
+        return self.pages_to_draw.after(self.page_count)
+    
+    def _page_canvas(self):
+        """Returns the canvas for the current page, opening the next file if 
+        the output is chunked."""
+        self._open_file()
+        return self.canvas
+    
+    def _open_file(self):
+        chunk = self._file_chunk()
+        if chunk != self._chunk:
+            self._close_file()
+            path = self.outfile
+            if self.pages_per_file is not None:
+                path = chunk_path(self.outfile, chunk)
+            self.canvas = Canvas(path, pagesize=self._pagesize)
+            self.outfiles.append(path)
+            self._chunk = chunk
+    
+    def _close_file(self):
+        if self.canvas is not None:
+            self.canvas.save()
+            self.canvas = None
+    
+    def _draw_label(self, obj, count):
+        # Same as labels.Sheet._draw_label, except that nothing is drawn 
+        # unless some copy of the label is on a page that is written
+        label = None
+        for i in range(count):
+            self._next_unused_label()
+            if self.page_count not in self.pages_to_draw:
+                continue
+            if label is None:
+                label = self._label_drawing(obj)
+            page_label = copy(label)
+            page_label.shift(*self._calculate_edges())
+            self._current_page.add(page_label)
+    
+    def _label_drawing(self, obj):
+        label = shapes.Drawing(float(self._lw), float(self._lh))
+        label.add(self._clip_label)
+        available = shapes.Drawing(float(self._dw), float(self._dh))
+        available.add(self._clip_drawing)
+        self.drawing_callable(available, float(self._dw), float(self._dh), obj)
+        available.shift(float(self._lp), float(self._bp))
+        label.add(available)
+        if self.border:
+            label.add(self._border)
+        return label
+    
+    def _new_page(self):
+        self._flush_page()
+        labels.Sheet._new_page(self)
+    
+    def _flush_page(self):
+        """Render the current page, then release it."""
+        if self._current_page is not None:
+            if self.page_count in self.pages_to_draw:
+                self._render_page()
+            self._current_page = None
+            del self._pages[:]
+    
+    @profiler.timed("render")
+    def _render_page(self):
+        _SheetRenderer().draw(renderPDF.renderScaledDrawing(self._current_page), 
+            self._page_canvas(), 0, 0)
+        self._end_page()
+    
+    def _end_page(self):
+        profiler.count("pages")
+        self._page_canvas().showPage()
+        if self.pages_per_file is not None and self.page_count % self.pages_per_file == 0:
+            self._close_file()
+        if self.progress is not None:
+            self.progress.page(self.page_count)
+    
+    def _finish(self):
+        self._shade_remaining_missing()
+        self._flush_page()
+
+    def add_pages(self, pages):
+        """Render pages that have already been drawn, e.g. by another process. 
+        Pages that are not written may be given as None."""
+        for page in pages:
+            self._flush_page()
+            self._current_page = page
+            self.page_count += 1
+
+class CanvasSheet(StreamingSheet):
+    """Sheet that draws labels straight onto the output canvas, without building a
+    reportlab.graphics Drawing for each label and page. Labels draw on a CanvasLabel,
+    which renders each shape as soon as it is added."""
+    def _new_page(self):
+        if self.page_count in self.pages_to_draw:
+            self._end_page()
+        self.page_count += 1
+        self._position = [1, 0]
+        if self._bgimage and self.page_count in self.pages_to_draw:
+            background = shapes.Drawing(*self._pagesize)
+            background.add(self._bgimage)
+            _SheetRenderer().draw(background, self._page_canvas(), 0, 0)
+    
+    def _draw_label(self, obj, count):
+        for i in range(count):
+            self._next_unused_label()
+            if self.page_count not in self.pages_to_draw:
+                continue
+            
+            canvas = self._page_canvas()
+            canvas.saveState()
+            canvas.translate(*self._calculate_edges())
+            self._clip(self._lw, self._lh, self._cr)
+            canvas.saveState()
+            canvas.translate(float(self._lp), float(self._bp))
+            self._clip(self._dw, self._dh, self._pr)
+            self.drawing_callable(CanvasLabel(canvas), float(self._dw), float(self._dh), obj)
+            canvas.restoreState()
+            if self.border:
+                # Stroked inside the label clip, as pylabels does, so only the 
+                # inner half of the line is drawn
+                canvas.setStrokeColor(colors.black)
+                canvas.setLineWidth(1)
+                canvas.drawPath(self._path(self._lw, self._lh, self._cr), stroke=1, fill=0)
+            canvas.restoreState()
+    
+    def _shade_missing_label(self):
+        if self.page_count not in self.pages_to_draw:
+            return
+        canvas = self._page_canvas()
+        canvas.saveState()
+        canvas.translate(*self._calculate_edges())
+        canvas.setFillColor(self.shade_missing)
+        canvas.drawPath(self._path(self._lw, self._lh, self._cr), stroke=0, fill=1)
+        canvas.restoreState()
+    
+    def _clip(self, width, height, radius):
+        self.canvas.clipPath(self._path(width, height, radius), stroke=0, fill=0)
+    
+    def _path(self, width, height, radius):
+        path = self.canvas.beginPath()
+        if radius:
+            path.roundRect(0, 0, float(width), float(height), float(radius))
+        else:
+            path.rect(0, 0, float(width), float(height))
+        return path
+    
+    def _finish(self):
+        self._shade_remaining_missing()
+        if self.page_count in self.pages_to_draw:
+            self._end_page()
+
+class CanvasLabel(object):
+    """Stands in for the Drawing that a label is drawn on, rendering each shape onto
+    a pdfgen canvas as soon as it is added. Strings are drawn with drawString and 
+    images with drawImage. A Group of filled rectangles, such as a QR code, is drawn 
+    as a single path, as is a QrPath, and a LabelForm is drawn as a form XObject. 
+    Anything else is drawn with the usual renderer."""
+    def __init__(self, canvas):
+        self.canvas = canvas
+    
+    def add(self, node, name=None):
+        if isinstance(node, LabelForm):
+            node.draw_form(self.canvas, lambda: self.draw_group(node))
+        elif isinstance(node, shapes.String):
+            self.draw_string(node)
+        elif isinstance(node, shapes.Image):
+            self.canvas.drawImage(node.path, node.x, node.y, node.width, node.height)
+        elif isinstance(node, shapes.Group) and tuple(node.transform) == _IDENTITY:
+            self.draw_group(node)
+        elif isinstance(node, shapes.Path) and hasattr(node, "rects"):
+            if node.fillColor is not None:
+                self.draw_rects(node.rects, node.fillColor)
+        else:
+            drawing = shapes.Drawing(0, 0)
+            drawing.add(node)
+            _SheetRenderer().draw(drawing, self.canvas, 0, 0)
+    
+    def draw_string(self, string):
+        canvas = self.canvas
+        canvas.setFont(string.fontName, string.fontSize)
+        canvas.setFillColor(string.fillColor)
+        if string.textAnchor == "end":
+            canvas.drawRightString(string.x, string.y, string.text)
+        elif string.textAnchor == "middle":
+            canvas.drawCentredString(string.x, string.y, string.text)
+        else:
+            canvas.drawString(string.x, string.y, string.text)
+    
+    def draw_group(self, group):
+        contents = group.getContents()
+        if not all(_is_plain_rect(node) for node in contents):
+            for node in contents:
+                self.add(node)
+            return
+        
+        # One path for each fill color; unfilled rectangles are invisible
+        rects = OrderedDict()
+        for rect in contents:
+            if rect.fillColor is not None:
+                rects.setdefault(rect.fillColor, []).append(
+                    (rect.x, rect.y, rect.width, rect.height))
+        for color, color_rects in rects.items():
+            self.draw_rects(color_rects, color)
+    
+    def draw_rects(self, rects, color):
+        """Fill a list of (x, y, width, height) rectangles as one path."""
+        path = self.canvas.beginPath()
+        for x, y, width, height in rects:
+            path.rect(x, y, width, height)
+        self.canvas.setFillColor(color)
+        self.canvas.drawPath(path, stroke=0, fill=1)
+
+_IDENTITY = (1, 0, 0, 1, 0, 0)
+
+def _is_plain_rect(node):
+    """Whether a shape is a rectangle with square corners and no outline."""
+    return (isinstance(node, shapes.Rect) and node.strokeColor is None 
+        and not node.rx and not node.ry)
+
+def make_labels(specs, label_list, outfile, skip=0, draw_border=True, fonts=None, 
+        progress=None, jobs=1, pages_per_shard=10, renderer="drawing", 
+        pages_per_file=None, start_page=1, end_page=None, page_cache=None, 
+        printer=None):
+    """Make labels for a given set of Label objects.
+    
+    `label_list` may be any iterable, including a generator. Labels are drawn as they
+    are consumed and each page is written out as soon as it is full, so memory use does
+    not depend on the number of labels. If `progress` is given, its `page` method is
+    called with the page count each time a page is written.
+    
+    `fonts` is a FontRegistry, or a list of directories to search for TrueType fonts.
+    
+    If `jobs` > 1, labels are split into shards of `pages_per_shard` pages, which are 
+    drawn by a pool of `jobs` processes and then written out in order. Label objects 
+    must be picklable.
+    
+    `renderer` is either "drawing", to build each page as a reportlab.graphics Drawing
+    and then render it, or "canvas", to draw labels straight onto the PDF canvas. The
+    output looks the same; "canvas" is faster, but cannot be combined with `jobs`.
+    The "zpl" renderer writes ZPL for a thermal label printer instead of a PDF, with
+    each label on a page of its own; `printer` is a dict of printer options (see 
+    `labelmaker.zpl`). It cannot be combined with `jobs` or `page_cache`.
+    
+    If `pages_per_file` is given, the output is split into files of at most that many
+    pages, named by `chunk_path`, and each file is closed as soon as it is full. Only
+    pages `start_page` to `end_page` are written, so that part of a job (e.g. one file)
+    can be made again; labels before `start_page` are laid out but not drawn. File
+    numbers do not depend on `start_page`. Returns the paths of the files written.
+    
+    If `page_cache` (a PageCache) is given, pages that have been drawn before are 
+    copied from the cache, and only new pages are rendered. Labels must have a
+    `cache_key` method; see `DefaultLabel.cache_key`.
+    """
+    sheet_class = get_sheet_class(renderer)
+    if jobs > 1 and renderer != "drawing":
+        raise ValueError("Multiple jobs require the 'drawing' renderer")
+    if jobs > 1 and page_cache is not None:
+        raise ValueError("The page cache cannot be combined with multiple jobs")
+    if page_cache is not None and renderer not in RENDERERS:
+        raise ValueError("The page cache requires a PDF renderer")
+    if start_page < 1:
+        raise ValueError("start_page must be at least 1")
+    if end_page is not None and end_page < start_page:
+        raise ValueError("end_page must not be less than start_page")
+    if not isinstance(fonts, FontRegistry):
+        fonts = FontRegistry(fonts)
+    skipped = skipped_positions(specs, skip)
+    
+    if page_cache is not None:
+        return _make_cached_labels(specs, label_list, outfile, skipped, draw_border, 
+            fonts, progress, renderer, pages_per_file, PageRange(start_page, end_page),
+            page_cache)
     
     # create the sheet
     # The draw function just calls Label.draw
-    def draw_label(label, width, height, obj):
-        if obj is not None:
-            obj.draw(label, width, height, font_paths)
-    sheet = labels.Sheet(specs, draw_label, border=draw_border)
-    
-    if skip > 0:
-        cols = specs.columns
-        rows = specs.rows
-        labels_per_page = cols * rows
-        skip = skip % labels_per_page
-        partial = []
-        for i in xrange(rows):
-            for j in xrange(cols):
-                partial.append(i+1,j+1)
-                skip -= 1
-                if skip <= 0:
+    kwargs = dict(border=draw_border)
+    if renderer == "zpl":
+        kwargs["printer"] = printer
+    sheet = sheet_class(specs, _label_drawer(fonts), outfile, progress, 
+        pages_per_file, start_page, end_page, **kwargs)
+    
+    if jobs > 1:
+        def add_shard(result):
+            pages, stats = result
+            if stats is not None:
+                profiler.merge(stats)
+            sheet.add_pages(pages)
+        
+        import multiprocessing
+        pool = multiprocessing.Pool(jobs)
+        try:
+            # Limit the number of shards in flight, so that labels are not read 
+            # faster than they are written
+            pending = deque()
+            first_page = 1
+            for shard in _page_shards(specs, label_list, len(skipped), pages_per_shard):
+                npages = _shard_pages(specs, shard, len(skipped or ()))
+                last_page = first_page + npages - 1
+                if sheet.pages_to_draw.after(first_page):
                     break
-        sheet.partial_page(1, partial)
+                if start_page > last_page:
+                    # No need to draw shards that are not written
+                    pending.append(_Result(([None] * npages, None)))
+                else:
+                    pending.append(pool.apply_async(_draw_shard, 
+                        (specs, draw_border, fonts, shard, skipped, profiler.enabled)))
+                first_page = last_page + 1
+                skipped = None
+                if len(pending) >= 2 * jobs:
+                    add_shard(pending.popleft().get())
+            while pending:
+                add_shard(pending.popleft().get())
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
     
-    # add labels
-    sheet.add_labels(label_list)
+    else:
+        if skipped:
+            sheet.partial_page(1, skipped)
+        
+        # add labels, stopping after the last page to write
+        sheet.add_labels(takewhile(lambda label: not sheet.done, label_list))
 
     # Save the file and we are done.
-    sheet.save(outfile)
+    sheet.save()
+    return sheet.outfiles
+
+# Sheet classes for each of make_labels' PDF renderers
+RENDERERS = dict(drawing=StreamingSheet, canvas=CanvasSheet)
+
+def get_sheet_class(renderer):
+    """Returns the sheet class for a value of make_labels' `renderer` argument."""
+    if renderer == "zpl":
+        # Imported here, since the ZPL module imports this one
+        from .zpl import ZplSheet
+        return ZplSheet
+    if renderer not in RENDERERS:
+        raise ValueError("Unknown renderer {0}".format(renderer))
+    return RENDERERS[renderer]
+
+def skipped_positions(specs, skip):
+    """Returns the (row, column) positions of the first `skip` labels on a page; 
+    whole pages are not skipped."""
+    skip = skip % (specs.columns * specs.rows)
+    return list((i // specs.columns + 1, i % specs.columns + 1) for i in xrange(skip))
+
+def _label_drawer(fonts):
+    @profiler.timed("draw")
+    def draw_label(label, width, height, obj):
+        profiler.count("labels")
+        if obj is not None:
+            obj.draw(label, width, height, fonts)
+    return draw_label
+
+def _page_shards(specs, label_list, nskipped, pages_per_shard):
+    """Split a stream of labels into lists that exactly fill `pages_per_shard` pages
+    (except for the last one). The first `nskipped` positions on the first page are
+    already used."""
+    labels_per_page = specs.columns * specs.rows
+    size = (pages_per_shard * labels_per_page) - nskipped
+    shard = []
+    for label in label_list:
+        shard.append(label)
+        if len(shard) == size:
+            yield shard
+            shard = []
+            size = pages_per_shard * labels_per_page
+    if shard:
+        yield shard
+
+def _make_cached_labels(specs, label_list, outfile, skipped, draw_border, fonts, 
+        progress, renderer, pages_per_file, page_range, page_cache):
+    """Make labels one page at a time, rendering only the pages that are not in
+    the page cache, then copy the pages into the output file(s)."""
+    # Everything that affects the drawing of a page other than its labels
+    job_key = (sorted((k, str(v)) for k, v in vars(specs).items()), draw_border, 
+        renderer, list(fonts.font_paths or ()), icon_cache.cache_key())
+    
+    def render(page_labels, page_skipped):
+        def render_to(path):
+            sheet = RENDERERS[renderer](specs, _label_drawer(fonts), path, 
+                border=draw_border)
+            if page_skipped:
+                sheet.partial_page(1, page_skipped)
+            sheet.add_labels(page_labels)
+            sheet.save()
+        return render_to
+    
+    pages = []
+    outfiles = []
+    page = 0
+    for page_labels in _page_shards(specs, label_list, len(skipped), 1):
+        page += 1
+        if page_range.after(page):
+            break
+        if page not in page_range:
+            continue
+        page_skipped = skipped if page == 1 else []
+        key = page_cache.key(job_key, page_skipped, 
+            list(label.cache_key() for label in page_labels))
+        pages.append(page_cache.get(key, render(page_labels, page_skipped)))
+        if pages_per_file is None:
+            outfiles.append(outfile)
+        else:
+            outfiles.append(chunk_path(outfile, (page - 1) // pages_per_file + 1))
+        if progress is not None:
+            progress.page(page)
+    
+    if pages:
+        page_cache.assemble(pages, outfiles)
+    elif pages_per_file is None:
+        # Always write the output file, even if it has no labels
+        Canvas(outfile, pagesize=(float(specs.sheet_width) * units.mm, 
+            float(specs.sheet_height) * units.mm)).save()
+        outfiles.append(outfile)
+    page_cache.evict()
+    
+    # Unique output paths, in order
+    return list(OrderedDict.fromkeys(outfiles))
+
+def _shard_pages(specs, label_list, nskipped):
+    """Returns the number of pages taken up by a shard."""
+    labels_per_page = specs.columns * specs.rows
+    return max(1, -(-(len(label_list) + nskipped) // labels_per_page))
+
+class _Result(object):
+    """Stands in for the AsyncResult of a shard that does not need to be drawn."""
+    def __init__(self, value):
+        self.value = value
+    
+    def get(self):
+        return self.value
+
+def _draw_shard(specs, draw_border, fonts, label_list, skipped, profile):
+    """Draw a shard of labels in a worker process; returns the page drawings and 
+    the profiler stats for the shard."""
+    # Start from nothing, in case stats were inherited from the parent process
+    profiler.reset()
+    profiler.enable(profile)
+    sheet = labels.Sheet(specs, _label_drawer(fonts), border=draw_border)
+    if skipped:
+        sheet.partial_page(1, skipped)
+    sheet.add_labels(label_list)
+    return sheet._pages, profiler.collect()
 
 def make_qr(data, error="L", version=None, compress=None, **kwargs):
     """Encode data and generate a QR code. By default, the smallest possible code is
     created, and gzip compression is used if the data is smaller when compressed."""
     
-    # compress if requested
+    from reportlab.graphics.barcode import qr, qrencoder
+    
+    profiler.count("qr_bytes", len(data))
+    
+    # compress if requested; text is compressed as UTF-8, which is how the QR code
+    # encodes it. QrCodeWidget only accepts text, so compressed data is passed as 
+    # an 8-bit segment
     if compress != False:
-        compressed = z.compress(data, 9)
-        if compress == True or len(compressed) < len(data):
-            data = compressed
+        import zlib as z
+        raw = data if isinstance(data, bytes) else data.encode("utf-8")
+        compressed = z.compress(raw, 9)
+        if compress == True or len(compressed) < len(raw):
+            data = [qrencoder.QR8bitByte(compressed)]
     
     # create QR code
     # this may raise an error if the specified version is too
     # low to accomodate the data/error combination
     return qr.QrCodeWidget(data, barLevel=error, qrVersion=version, **kwargs)
+
+class QrCache(object):
+    """LRU cache of drawn QR codes. Codes are keyed on the data and all of the encoding 
+    and format options, so identical codes (e.g. on copies of the same label) are only 
+    encoded and drawn once. Codes are encoded and drawn by the qrengine module, which 
+    is faster for a batch of codes (see `prefetch`)."""
+    def __init__(self, maxsize=1024):
+        """
+        maxsize -- maximum number of codes to keep; 0 disables caching
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        # Keys of prefetched codes that have not been used yet; each was counted as
+        # a miss when it was prefetched, so its first use is not counted as a hit
+        self._prefetched = set()
+    
+    def get(self, data, error="L", version=None, compress=None, outline=False, **kwargs):
+        """Returns a tuple (qr, width), where qr is a shapes.Group that can be added to
+        any number of drawings. If `outline` is True, the code is only placed, not 
+        encoded, for renderers that encode QR codes themselves (see 
+        `qrengine.outline`). Other arguments are the same as for `make_qr`."""
+        key = (data, error, version, compress, outline, tuple(sorted(kwargs.items())))
+        if key in self._cache:
+            if key in self._prefetched:
+                self._prefetched.discard(key)
+            else:
+                self.hits += 1
+            value = self._cache.pop(key)
+        else:
+            self.misses += 1
+            value = self._draw(data, error, version, compress, outline, **kwargs)
+            if self.maxsize <= 0:
+                return value
+        self._cache[key] = value
+        self._evict()
+        return value
+    
+    @profiler.timed("qr")
+    def prefetch(self, values, error="L", version=None, compress=None, **kwargs):
+        """Encode and draw the codes for a batch of values at once, so that `get` 
+        finds them in the cache. Should be given no more than `maxsize` values."""
+        if self.maxsize <= 0:
+            return
+        options = (error, version, compress, False, tuple(sorted(kwargs.items())))
+        missing = OrderedDict()
+        for data in values:
+            key = (data,) + options
+            if key not in self._cache:
+                missing[key] = data
+                # Codes beyond maxsize would be evicted before they are used
+                if len(missing) == self.maxsize:
+                    break
+        self.misses += len(missing)
+        drawn = self._draw_many(list(missing.values()), error, version, compress, **kwargs)
+        for key, value in zip(missing, drawn):
+            self._cache[key] = value
+        self._prefetched.update(missing)
+        self._evict()
+    
+    @profiler.timed("qr")
+    def _draw(self, data, error, version, compress, outline, **kwargs):
+        if outline:
+            from . import qrengine
+            widget = make_qr(data, error, version, compress, **kwargs)
+            return (qrengine.outline(widget), widget.barWidth)
+        return self._draw_many([data], error, version, compress, **kwargs)[0]
+    
+    def _draw_many(self, values, error, version, compress, **kwargs):
+        from . import qrengine
+        widgets = list(make_qr(data, error, version, compress, **kwargs) for data in values)
+        qrengine.make_modules(widgets)
+        return list((qrengine.draw(widget), widget.barWidth) for widget in widgets)
+    
+    def resize(self, maxsize):
+        self.maxsize = maxsize
+        self._evict()
+    
+    def clear(self):
+        self._cache.clear()
+        self._prefetched.clear()
+        self.hits = self.misses = 0
+    
+    def _evict(self):
+        while len(self._cache) > max(self.maxsize, 0):
+            key = self._cache.popitem(last=False)[0]
+            self._prefetched.discard(key)
+
+# QR codes are shared by all labels in a run
+qr_cache = QrCache()
+
+class IconCache(object):
+    """Validates each icon image once per run. Icons are referred to by path, which 
+    lets the renderer embed each image in the PDF once and reference it from every
+    label that uses it."""
+    def __init__(self):
+        self._icons = {}
+    
+    def get(self, icon):
+        """Returns the path of a valid icon, loading it the first time it is seen."""
+        path = self._icons.get(icon, None)
+        if path is None:
+            path = self._icons[icon] = self._load(icon)
+        return path
+    
+    def load(self, icons):
+        """Load an iterable of icon paths up front."""
+        for icon in icons:
+            self.get(icon)
+    
+    def clear(self):
+        self._icons.clear()
+    
+    def cache_key(self):
+        """Returns the path and modification time of each icon, for the page cache."""
+        return sorted((path, os.path.getmtime(path)) for path in self._icons.values())
+    
+    def _load(self, icon):
+        if not os.path.exists(icon):
+            raise Exception("Could not locate icon {0}".format(icon))
+        try:
+            ImageReader(icon).getSize()
+        except Exception as e:
+            raise Exception("Could not load icon {0}: {1}".format(icon, e))
+        return os.path.abspath(icon)
+
+# Icons are shared by all labels in a run
+icon_cache = IconCache()
@@ -0,0 +1,122 @@
+"""On-disk cache of rendered pages. Each page is stored as a single-page PDF, named
+by a hash of everything that is drawn on it, so a job that is run again after a few
+rows have changed only has to render the pages those rows are on. The pages of a job
+are then copied into the output file, which requires PyPDF2.
+"""
+import hashlib
+from io import BytesIO
+import json
+import os
+
+from .util import profiler
+
+# Increment when a change to the code changes what is drawn for the same inputs
+PAGE_CACHE_VERSION = 1
+
+class PageCache(object):
+    """Directory of rendered pages. When the pages in the directory take up more than
+    `max_size` bytes, the least recently used pages are removed."""
+    default_dir = os.path.join("~", ".cache", "labelmaker", "pages")
+    default_max_size = 256 * 1024 * 1024
+    
+    def __init__(self, path=None, max_size=None):
+        """
+        path     -- cache directory; created if it does not exist
+        max_size -- maximum total size of the cached pages, in bytes
+        """
+        self.path = os.path.abspath(os.path.expanduser(path or self.default_dir))
+        self.max_size = self.default_max_size if max_size is None else max_size
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def key(*parts):
+        """Returns the hash of a JSON-serializable sequence of values."""
+        data = json.dumps((PAGE_CACHE_VERSION,) + parts, sort_keys=True, default=repr)
+        return hashlib.sha1(data.encode("utf-8")).hexdigest()
+    
+    def page_path(self, key):
+        return os.path.join(self.path, key + ".pdf")
+    
+    def get(self, key, render):
+        """Returns the path of the page with `key`. If the page is not in the cache,
+        `render` is called with the path to write it to."""
+        path = self.page_path(key)
+        if os.path.exists(path):
+            # The modification time records when the page was last used
+            os.utime(path, None)
+            self.hits += 1
+            profiler.count("cached_pages")
+        else:
+            tmp = "{0}.{1}.tmp".format(path, os.getpid())
+            try:
+                render(tmp)
+                os.rename(tmp, path)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+            self.misses += 1
+        return path
+    
+    def entries(self):
+        """Returns a list of (path, size, mtime) for each cached page, least recently
+        used first."""
+        entries = []
+        for name in os.listdir(self.path):
+            if name.endswith(".pdf"):
+                path = os.path.join(self.path, name)
+                st = os.stat(path)
+                entries.append((path, st.st_size, st.st_mtime))
+        entries.sort(key=lambda e: e[2])
+        return entries
+    
+    def size(self):
+        return sum(e[1] for e in self.entries())
+    
+    def evict(self, max_size=None):
+        """Remove the least recently used pages until the cache is no larger than
+        `max_size` (by default, the cache's max_size). Returns the number of pages
+        removed."""
+        if max_size is None:
+            max_size = self.max_size
+        entries = self.entries()
+        size = sum(e[1] for e in entries)
+        removed = 0
+        for path, page_size, mtime in entries:
+            if size <= max_size:
+                break
+            os.remove(path)
+            size -= page_size
+            removed += 1
+        return removed
+    
+    def clear(self):
+        return self.evict(0)
+    
+    @profiler.timed("assemble")
+    def assemble(self, pages, outfiles):
+        """Copy cached pages into output files. `pages` is a list of page paths and
+        `outfiles` a list of the same length with the file each page goes in; pages
+        are written in order."""
+        from PyPDF2 import PdfFileReader, PdfFileWriter
+        
+        def write(writer, outfile):
+            with open(outfile, "wb") as o:
+                writer.write(o)
+        
+        writer = outfile = None
+        for path, page_outfile in zip(pages, outfiles):
+            if page_outfile != outfile:
+                if writer is not None:
+                    write(writer, outfile)
+                writer = PdfFileWriter()
+                outfile = page_outfile
+            # Pages are read lazily when the output is written, so each page is 
+            # read into memory rather than holding its file open until then
+            with open(path, "rb") as i:
+                page = BytesIO(i.read())
+            writer.addPage(PdfFileReader(page).getPage(0))
+        if writer is not None:
+            write(writer, outfile)
@@ -0,0 +1,227 @@
+"""QR code engine. Codes are encoded by reportlab's QR encoder, so they are the same
+as those drawn by QrCodeWidget, with two differences:
+
+* The mask pattern, which reportlab chooses by drawing and scoring the code eight
+  times in pure Python, is chosen with NumPy array operations if NumPy is installed,
+  for a whole batch of codes at once.
+* A code is drawn as one path, made of as few rectangles as possible, rather than
+  as a group with a rectangle for every run of dark modules.
+"""
+from itertools import groupby
+
+from reportlab.graphics import shapes
+
+# NumPy is optional and slow to import, so it is imported the first time it is needed
+_numpy = []
+
+def get_numpy():
+    """Returns the numpy module, or None if it is not installed."""
+    if not _numpy:
+        try:
+            import numpy
+            _numpy.append(numpy)
+        except ImportError:
+            _numpy.append(None)
+    return _numpy[0]
+
+class QrPath(shapes.Path):
+    """Path made of rectangles. Renderers that know about it (see _SheetRenderer and
+    CanvasLabel) draw the rectangles directly; any other renderer draws the path.
+    Renderers that encode QR codes themselves (see ZplLabel) use `code` instead."""
+    def __init__(self, rects, fillColor, code=None):
+        """
+        rects     -- list of (x, y, width, height)
+        fillColor -- color of the rectangles
+        code      -- dict describing the QR code that the rectangles draw: its 
+                     encoded "value", error correction "level", number of 
+                     "modules" per side, module size ("box"), and the "x" and 
+                     "top" of the symbol, excluding the quiet zone
+        """
+        points = []
+        operators = []
+        for x, y, width, height in rects:
+            points.extend((x, y, x + width, y, x + width, y + height, x, y + height))
+            operators.extend((_MOVETO, _LINETO, _LINETO, _LINETO, _CLOSEPATH))
+        shapes.Path.__init__(self, points, operators, autoclose="pdf",
+            fillColor=fillColor, strokeColor=None, strokeWidth=0)
+        # Bypasses attribute validation, as QrCodeWidget does for its QRCode
+        self.__dict__["rects"] = rects
+        self.__dict__["code"] = code
+
+_MOVETO, _LINETO, _CURVETO, _CLOSEPATH = range(4)
+
+def make_modules(widgets):
+    """Encode the data of a list of QrCodeWidgets, filling in the module matrix of
+    each widget's QR code (widget.qr.modules)."""
+    codes = list(widget.qr for widget in widgets)
+    for code in codes:
+        if code.version is None:
+            code.version = code.calculate_version()
+
+    if get_numpy() is None:
+        masks = list(code.getBestMaskPattern() for code in codes)
+    else:
+        # Codes with the same version are scored together
+        masks = [None] * len(codes)
+        by_version = {}
+        for i, code in enumerate(codes):
+            by_version.setdefault(code.version, []).append(i)
+        for indexes in by_version.values():
+            best = best_masks(list(codes[i] for i in indexes))
+            for i, mask in zip(indexes, best):
+                masks[i] = mask
+
+    for code, mask in zip(codes, masks):
+        code.makeImpl(False, mask)
+
+def draw(widget):
+    """Draw a QrCodeWidget whose modules have been made, as a Group containing a
+    single QrPath. The code is placed exactly as QrCodeWidget.draw places it."""
+    modules = widget.qr.modules
+    count = len(modules)
+    border = widget.barBorder
+    boxsize, offset_x, top = _placement(widget, count)
+    rects = list(
+        (offset_x + (col + border) * boxsize, top - (row + nrows + border) * boxsize,
+         ncols * boxsize, nrows * boxsize)
+        for row, col, nrows, ncols in module_rects(modules))
+    return _group(widget, rects, count, boxsize, offset_x, top)
+
+def outline(widget):
+    """Place a QrCodeWidget's code without encoding it, for renderers that encode QR
+    codes themselves. Only the version of the code, which sets its size, is 
+    calculated. Returns a Group containing a QrPath with no rectangles."""
+    code = widget.qr
+    if code.version is None:
+        code.version = code.calculate_version()
+    count = code.version * 4 + 17
+    boxsize, offset_x, top = _placement(widget, count)
+    return _group(widget, [], count, boxsize, offset_x, top)
+
+def _placement(widget, count):
+    """Returns the module size, and the left and top of the code including its 
+    quiet zone, for a code with `count` modules per side."""
+    width = widget.barWidth
+    height = widget.barHeight
+    minwh = float(min(width, height))
+    boxsize = minwh / (count + widget.barBorder * 2.0)
+    offset_x = widget.x + (width - minwh) / 2.0
+    top = widget.y + (minwh - height) / 2.0 + height
+    return boxsize, offset_x, top
+
+def _group(widget, rects, count, boxsize, offset_x, top):
+    border = widget.barBorder
+    code = dict(value=code_value(widget), level=widget.barLevel, modules=count,
+        box=boxsize, x=offset_x + border * boxsize, top=top - border * boxsize)
+    group = shapes.Group()
+    group.add(QrPath(rects, widget.barFillColor, code))
+    return group
+
+def code_value(widget):
+    """Returns the data encoded by a QrCodeWidget: its text, or the bytes of its 
+    segments if it was given a list of segments (see make_qr)."""
+    value = widget.value
+    if isinstance(value, (list, tuple)):
+        value = b"".join(segment.data for segment in value)
+    return value
+
+def module_rects(modules):
+    """Cover the dark modules of a matrix with rectangles. Runs of dark modules in
+    each row are merged with identical runs in the rows below. Returns a list of
+    (row, column, rows, columns)."""
+    rects = []
+    above = {}
+    for r, row in enumerate(modules):
+        runs = {}
+        c = 0
+        for dark, run in groupby(row):
+            n = len(list(run))
+            if dark:
+                rect = above.get((c, n), None)
+                if rect is None:
+                    rect = [r, c, 0, n]
+                    rects.append(rect)
+                rect[2] += 1
+                runs[(c, n)] = rect
+            c += n
+        above = runs
+    return rects
+
+# Finder-like pattern penalized by reportlab's mask scoring (rule 3)
+_RULE3_PATTERN = (True, False, True, True, True, False, True, False, False, False, False)
+
+def best_masks(codes):
+    """Choose the mask pattern for each of a list of QRCodes of the same version,
+    scoring all eight masks of every code at once. The score is the same as
+    reportlab's QRUtil.getLostPoint, so the same mask is chosen."""
+    np = get_numpy()
+    n = codes[0].version * 4 + 17
+
+    # Unmasked matrices: function patterns in test mode, plus the data bits
+    base = np.empty((len(codes), n, n), dtype=bool)
+    bits = None
+    for i, code in enumerate(codes):
+        code.makeImpl(True, 0)
+        base[i] = code.modules
+        positions = code.dataPosIterator()
+        code_bits = list(code._dataBitList)
+        code_bits.extend([False] * (len(positions) - len(code_bits)))
+        if bits is None:
+            bits = np.empty((len(codes), len(positions)), dtype=bool)
+        bits[i] = code_bits[:len(positions)]
+    cols, rows = (np.array(p) for p in zip(*positions))
+
+    # Apply every mask to every code: (codes, masks, n, n)
+    i, j = rows, cols
+    mask_bits = np.array([
+        (i + j) % 2 == 0,
+        i % 2 == 0,
+        j % 3 == 0,
+        (i + j) % 3 == 0,
+        (i // 2 + j // 3) % 2 == 0,
+        (i * j) % 2 + (i * j) % 3 == 0,
+        ((i * j) % 2 + (i * j) % 3) % 2 == 0,
+        ((i * j) % 3 + (i + j) % 2) % 2 == 0])
+    matrices = np.repeat(base[:, None], 8, axis=1)
+    matrices[:, :, rows, cols] = bits[:, None, :] ^ mask_bits[None, :, :]
+    matrices = matrices.reshape(-1, n, n)
+
+    # reportlab also looks for the pattern down columns, but compares tuples to a
+    # list there, so never finds it; columns are not scored, to choose the same mask
+    scores = (_run_score(np, matrices) + _run_score(np, matrices.transpose(0, 2, 1))
+        + _block_score(np, matrices) + _pattern_score(np, matrices)
+        + _balance_score(np, matrices))
+    # argmin returns the first of equal scores, as reportlab does
+    return list(int(m) for m in scores.reshape(len(codes), 8).argmin(axis=1))
+
+def _run_score(np, m):
+    """Runs of 5 or more modules of the same color down each column score their
+    length - 2: one point per 5-module window in the run, plus 2 per run."""
+    same = m[:, 1:, :] == m[:, :-1, :]
+    windows = same[:, :-3, :] & same[:, 1:-2, :] & same[:, 2:-1, :] & same[:, 3:, :]
+    starts = windows.copy()
+    starts[:, 1:, :] &= ~same[:, :-4, :]
+    return windows.sum(axis=(1, 2)) + 2 * starts.sum(axis=(1, 2))
+
+def _block_score(np, m):
+    """Each 2x2 block of the same color scores 3."""
+    block = ((m[:, 1:, 1:] == m[:, :-1, 1:]) & (m[:, 1:, 1:] == m[:, 1:, :-1])
+        & (m[:, 1:, 1:] == m[:, :-1, :-1]))
+    return 3 * block.sum(axis=(1, 2))
+
+def _pattern_score(np, m):
+    """Each occurrence of the pattern in a row scores 40. Like reportlab, the pattern
+    is not looked for at the last possible position in the row."""
+    n = m.shape[2]
+    plen = len(_RULE3_PATTERN)
+    found = np.ones((m.shape[0], m.shape[1], n - plen), dtype=bool)
+    for t, dark in enumerate(_RULE3_PATTERN):
+        window = m[:, :, t:t + n - plen]
+        found &= window if dark else ~window
+    return 40 * found.sum(axis=(1, 2))
+
+def _balance_score(np, m):
+    """Scores the deviation of the proportion of dark modules from 50%."""
+    cells = m.shape[1] * m.shape[2]
+    dark = m.sum(axis=(1, 2))
+    return 10 * (np.abs(100 * dark // cells - 50) // 5)
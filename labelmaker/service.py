@@ -0,0 +1,187 @@
+"""Long-running label service. Configs, fonts, icons, layouts and QR codes stay in
+memory between jobs, so that each job only pays for reading its rows and drawing
+its labels. Jobs are JSON objects, one per line, read from a stream (e.g. stdin) or
+from connections to a Unix socket; each job gets one line of JSON in response. A
+batch of jobs can also be run at once, by several processes (see `run_batch`).
+
+A job has the following fields; all but "labelConfig" and one of "infile", 
+"workbook" or "rows" are optional, and have the same meaning as the make-labels.py
+options:
+    
+    id            -- returned unchanged in the response
+    labelConfig   -- path of the label config file
+    pageConfig    -- path of the page config file
+    infile        -- path of a CSV file to read rows from
+    delimiter     -- delimiter of the CSV file
+    workbook      -- path of an Excel file to read rows from
+    sheet         -- worksheet name or index (default 1)
+    rows          -- table rows, as a list of lists
+    header        -- whether the first row of the table is a header (default true)
+    textStrings, qrString, iconColumn, countColumn, indexString, skip, renderer
+    outfile       -- path of the PDF file to write; if not given, the PDF is returned
+                     in the response, base64 encoded
+
+The response has the fields "id", "ms" (the time taken by the job, in milliseconds),
+and either "outfile", "pdf" (or "zpl", for the zpl renderer) or "error".
+"""
+import base64
+from io import BytesIO
+import json
+import os
+import socket
+import sys
+
+from .labelmaker import default_templates, make_labels_from_table, read_config
+from .util import CsvReader, ExcelReader, RowListReader, clock
+
+class LabelService(object):
+    """Runs label jobs, keeping prepared configs between jobs. A config is prepared
+    again if its files have changed since it was last used."""
+    def __init__(self, page_config=None):
+        """
+        page_config -- path of the page config file to use for jobs that do not
+                       specify one; by default, the page config that comes with
+                       labelmaker
+        """
+        self.page_config = page_config
+        self._configs = {}
+        self.jobs = 0
+    
+    def get_config(self, label_config, page_config=None):
+        paths = tuple(os.path.abspath(p) if p is not None else None
+            for p in (label_config, page_config or self.page_config))
+        mtimes = tuple(os.path.getmtime(p) if p is not None else None for p in paths)
+        cached = self._configs.get(paths, None)
+        if cached is None or cached[0] != mtimes:
+            cached = self._configs[paths] = (mtimes, read_config(*paths))
+        return cached[1]
+    
+    def run(self, job):
+        """Run a job, given as a dict. Returns the response dict."""
+        start = clock()
+        response = dict(id=job.get("id", None))
+        try:
+            response.update(self._run(job))
+        except Exception as e:
+            response["error"] = "{0}: {1}".format(e.__class__.__name__, e)
+        response["ms"] = round(1000 * (clock() - start), 3)
+        self.jobs += 1
+        return response
+    
+    def _run(self, job):
+        if "labelConfig" not in job:
+            raise Exception("No labelConfig")
+        config = self.get_config(job["labelConfig"], job.get("pageConfig", None))
+        text_strings, qr_string = default_templates(config,
+            job.get("textStrings", None), job.get("qrString", None))
+        
+        header = job.get("header", True)
+        if "rows" in job:
+            reader = RowListReader(job["rows"], header)
+        elif "infile" in job:
+            reader = CsvReader(job["infile"], header,
+                delimiter=str(job.get("delimiter", ",")), skipinitialspace=True)
+        elif "workbook" in job:
+            reader = ExcelReader(job["workbook"], job.get("sheet", 1), header,
+                config.get("dateFormat", "%Y-%m-%d"))
+        else:
+            raise Exception("No rows, infile or workbook")
+        
+        outfile = job.get("outfile", None)
+        renderer = job.get("renderer", "drawing")
+        output = None if outfile is not None else BytesIO()
+        try:
+            make_labels_from_table(reader, text_strings, qr_string,
+                job.get("iconColumn", None), job.get("countColumn", None),
+                job.get("indexString", None), outfile or output, config,
+                job.get("skip", 0), renderer=renderer)
+        finally:
+            reader.close()
+        
+        if outfile is not None:
+            return dict(outfile=outfile)
+        key = "zpl" if renderer == "zpl" else "pdf"
+        return {key: base64.b64encode(output.getvalue()).decode("ascii")}
+    
+    def serve(self, infile=sys.stdin, outfile=sys.stdout):
+        """Run jobs read from `infile`, one JSON object per line, and write the
+        responses to `outfile`, until the end of the input."""
+        for line in iter(infile.readline, ""):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                job = json.loads(line)
+            except ValueError as e:
+                response = dict(id=None, error="Invalid job: {0}".format(e), ms=0)
+            else:
+                response = self.run(job)
+            outfile.write(json.dumps(response) + "\n")
+            outfile.flush()
+    
+    def serve_socket(self, path):
+        """Accept connections on a Unix socket, and serve each one in turn until
+        it is closed. Jobs are run one at a time, since the caches are shared."""
+        if os.path.exists(path):
+            os.remove(path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            server.bind(path)
+            server.listen(5)
+            while True:
+                conn, addr = server.accept()
+                try:
+                    self.serve(conn.makefile("r"), conn.makefile("w"))
+                except socket.error:
+                    pass
+                finally:
+                    conn.close()
+        finally:
+            server.close()
+            os.remove(path)
+
+def run_batch(jobs, workers=1, page_config=None):
+    """Run a list of jobs, yielding the response to each one in order. A job that
+    fails does not stop the batch; its response has an "error" field.
+    
+    Each distinct config is prepared once, up front. If `workers` > 1, jobs are run
+    by a pool of that many processes, each of which is given the prepared configs
+    and keeps its own fonts, icons and QR codes between the jobs it runs. Drawing is
+    pure Python, so threads would not run jobs any faster than one at a time.
+    """
+    service = LabelService(page_config)
+    for job in jobs:
+        if "labelConfig" in job:
+            try:
+                service.get_config(job["labelConfig"], job.get("pageConfig", None))
+            except Exception:
+                # Reported in the job's response
+                pass
+    
+    if workers <= 1:
+        for job in jobs:
+            yield service.run(job)
+        return
+    
+    import multiprocessing
+    pool = multiprocessing.Pool(workers, _init_worker, (page_config, service._configs))
+    try:
+        for response in pool.imap(_run_worker_job, jobs):
+            yield response
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+# The service of a batch worker process
+_worker_service = []
+
+def _init_worker(page_config, configs):
+    service = LabelService(page_config)
+    service._configs.update(configs)
+    _worker_service.append(service)
+
+def _run_worker_job(job):
+    return _worker_service[0].run(job)
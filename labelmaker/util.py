@@ -1,110 +1,366 @@
+import csv
 import datetime
+import functools
+from itertools import islice
+import json
+from operator import itemgetter
+import string
+import sys
+import time
 
-class AliasedDictReader(object):
-    """Wrapper around csv.DictReader that returns a dict in which keys are either
-    column names (if header==True) or column indicies (of the form "col<idx>"). In
-    the former case, rows are instances of AliasedDict, which enables items to be
-    accessed either by column name or column index.
-    """
-    def __init__(self, infile, header=True, **kwargs):
-        self.fh = open(infile, "rU")
-        first_row = csv.reader(self.fh, delimiter=args.delimiter, skipinitialspace=True).next()
-        aliases = list("col{0}".format(idx+1) for idx in xrange(len(first_row)))
-        if header:
-            fieldnames = first_row
-            aliases = dict(zip(aliases, fieldnames))
-        else:
-            fieldnames = aliases
-            aliases = None
+# Wall-clock timer with the best available resolution
+clock = getattr(time, "perf_counter", time.time)
+
+class Profiler(object):
+    """Records cumulative wall time and call counts for the stages of a job, along 
+    with named counters. Nothing is recorded until `enable` is called; until then, 
+    instrumented functions only pay for checking a flag. Stages can be nested (e.g. 
+    "wrap" happens during "draw"), so their times overlap."""
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+    
+    def enable(self, enabled=True):
+        self.enabled = enabled
+    
+    def reset(self):
+        self.times = {}
+        self.calls = {}
+        self.counters = {}
+    
+    def timed(self, stage):
+        """Decorator that records the time spent in a function under `stage`."""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                start = clock()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.add(stage, clock() - start)
+            return wrapper
+        return decorator
+    
+    def add(self, stage, seconds, calls=1):
+        self.times[stage] = self.times.get(stage, 0) + seconds
+        self.calls[stage] = self.calls.get(stage, 0) + calls
+    
+    def count(self, counter, n=1):
+        if self.enabled:
+            self.counters[counter] = self.counters.get(counter, 0) + n
+    
+    def collect(self):
+        """Returns everything recorded so far as a dict, and starts over."""
+        stats = dict(times=self.times, calls=self.calls, counters=self.counters)
+        self.reset()
+        return stats
+    
+    def merge(self, stats):
+        """Add stats returned by `collect`, e.g. in another process."""
+        for stage, seconds in stats["times"].items():
+            self.add(stage, seconds, stats["calls"][stage])
+        for counter, n in stats["counters"].items():
+            self.counters[counter] = self.counters.get(counter, 0) + n
+    
+    def summary(self):
+        lines = ["{0:<10} {1:>10} {2:>12} {3:>12}".format("stage", "calls", "total (s)", "mean (ms)")]
+        for stage in sorted(self.times, key=lambda s: -self.times[s]):
+            lines.append("{0:<10} {1:>10} {2:>12.3f} {3:>12.3f}".format(
+                stage, self.calls[stage], self.times[stage], 
+                1000 * self.times[stage] / self.calls[stage]))
+        for counter in sorted(self.counters):
+            lines.append("{0:<10} {1:>10}".format(counter, self.counters[counter]))
+        return "\n".join(lines) + "\n"
+    
+    def write_json(self, path):
+        with open(path, "w") as o:
+            json.dump(dict(times=self.times, calls=self.calls, counters=self.counters), 
+                o, indent=2, sort_keys=True)
+
+# Shared by all instrumented code
+profiler = Profiler()
 
-        self.reader = csv.DictReader(i, fieldnames, **kwargs)
-        self.aliases = aliases
+class TableReader(object):
+    """Base class for readers that return each row of a table as a tuple. Column names
+    (if the table has a header) and column aliases (of the form "col<idx>", one-based) 
+    are mapped to tuple indices once, by `column_key`. If only some of the columns are 
+    needed, `select` restricts rows to just those columns. Subclasses call 
+    `_set_columns` with the first row of the table and implement `next`.
+    """
+    def _set_columns(self, first_row, header):
+        self.width = len(first_row)
+        aliases = list("col{0}".format(idx+1) for idx in xrange(self.width))
+        self.fieldnames = list(first_row) if header else aliases
+        self._positions = dict(zip(aliases, xrange(self.width)))
+        self._positions.update(zip(self.fieldnames, xrange(self.width)))
+        self._selected = None
+        self._keys = None
+    
+    def select(self, columns):
+        """Only read the named columns. Must be called before any rows are read; 
+        `column_key` then gives positions within the selected columns."""
+        selected = []
+        for name in columns:
+            pos = self._position(name)
+            if pos not in selected:
+                selected.append(pos)
+        self._selected = selected
+        self._keys = dict((pos, i) for i, pos in enumerate(selected))
+    
+    def column_key(self, name):
+        pos = self._position(name)
+        if self._keys is not None:
+            if pos not in self._keys:
+                raise KeyError(name)
+            pos = self._keys[pos]
+        return pos
+    
+    def _position(self, name):
+        if name not in self._positions:
+            raise KeyError(name)
+        return self._positions[name]
     
     def __iter__(self):
         return self
     
+    def batches(self, size=1000):
+        """Iterate over lists of up to `size` rows."""
+        while True:
+            batch = list(islice(self, size))
+            if not batch:
+                break
+            yield batch
+    
+    def close(self):
+        pass
+
+class CsvReader(TableReader):
+    """Reader for delimited text files."""
+    def __init__(self, infile, header=True, columns=None, **kwargs):
+        """
+        infile  -- path of the file to read
+        header  -- whether the file has a header row
+        columns -- names or aliases of the columns to read; by default, all columns
+        kwargs  -- passed through to csv.reader (e.g. delimiter)
+        """
+        self.fh = open(infile, "rU")
+        self.reader = csv.reader(self.fh, **kwargs)
+        first_row = self.reader.next()
+        self._set_columns(first_row, header)
+        self._pending = None if header else first_row
+        self._project = None
+        if columns is not None:
+            self.select(columns)
+    
+    def select(self, columns):
+        TableReader.select(self, columns)
+        if len(self._selected) == 0:
+            # No columns are used (e.g. the text is fixed), but rows are still counted
+            self._project = lambda row: ()
+        elif len(self._selected) == 1:
+            pos = self._selected[0]
+            self._project = lambda row: (row[pos],)
+        else:
+            self._project = itemgetter(*self._selected)
+    
+    @profiler.timed("read")
     def next(self):
-        row = self.reader.next()
-        if self.aliases is not None:
-            row = AliasedDict(row, self.aliases)
-        return row
+        if self._pending is not None:
+            row = self._pending
+            self._pending = None
+        else:
+            row = self.reader.next()
+        # Skip blank lines, as csv.DictReader does
+        while not row:
+            row = self.reader.next()
+        if len(row) < self.width:
+            row.extend([None] * (self.width - len(row)))
+        if self._project is not None:
+            return self._project(row)
+        return tuple(row)
     
     def close(self):
         self.fh.close()
 
-class ExcelReader(object):
-    def __init__(self, infile, sheet, header=True, date_format="%Y-%m-%d"):
+class RowListReader(TableReader):
+    """Reader for a table that is already in memory, as a sequence of rows."""
+    def __init__(self, rows, header=True, columns=None):
+        """
+        rows    -- sequence of rows, each a sequence of values
+        header  -- whether the first row is a header
+        columns -- names or aliases of the columns to read; by default, all columns
+        """
+        if len(rows) == 0:
+            raise Exception("Table has no rows")
+        self._set_columns(rows[0], header)
+        self.rows = iter(rows[1:] if header else rows)
+        self._project = None
+        if columns is not None:
+            self.select(columns)
+    
+    def select(self, columns):
+        TableReader.select(self, columns)
+        selected = self._selected
+        self._project = lambda row: tuple(row[i] if i < len(row) else None for i in selected)
+    
+    @profiler.timed("read")
+    def next(self):
+        row = self.rows.next()
+        if self._project is not None:
+            return self._project(row)
+        return tuple(row) + (None,) * (self.width - len(row))
+
+class ExcelReader(TableReader):
+    """Streaming reader for a worksheet of an Excel workbook. Only the cells of the 
+    selected columns are converted to strings, dates are formatted once per distinct
+    value, and blank rows at the end of the sheet are dropped."""
+    # Maximum number of formatted dates to keep
+    date_cache_size = 10000
+    
+    def __init__(self, infile, sheet, header=True, date_format="%Y-%m-%d", columns=None):
         """Open an excel workbook and iterate over the rows of a
         specific worksheet.
         i      -- a file name or file-like object
         sheet  -- sheet name or index
         header -- whether the workbook has a header row
         date_format -- strftime-style date format
+        columns -- names or aliases of the columns to read; by default, all columns
         """
         from openpyxl import load_workbook
         
-        wb = load_workbook(infile, data_only=True, use_iterators=True, keep_vba=False)
+        self.wb = load_workbook(infile, data_only=True, read_only=True, keep_vba=False)
     
         try:
-            sheet = wb.worksheets[int(sheet)-1]
+            sheet = self.wb.worksheets[int(sheet)-1]
     
         except:
-            for ws in wb.worksheets:
+            for ws in self.wb.worksheets:
                 if ws.title == sheet:
                     sheet = ws
                     break
             else:
                 raise Exception("No worksheet named {0}".format(sheet))
         
-        self.iter = sheet.iter_rows()
+        self.sheet = sheet
         self.date_format = date_format
+        self._dates = {}
         
+        first_row = ()
+        for row in sheet.iter_rows(min_row=1, max_row=1, values_only=True):
+            first_row = row
         if header:
-            self.fieldnames = self.format_excel_row(self.iter.next())
-            self.aliases = dict(zip(
-                list("col{0}".format(idx+1) for idx in xrange(len(self.fieldnames))),
-                self.fieldnames))
-        else:
-            self.fieldnames = list("col{0}".format(idx+1) for idx in xrange(len(sheet.columns))),
-            self.aliases = None
-    
-    def __iter__(self):
-        return self
+            first_row = tuple(self.format_value(val) for val in first_row)
+        self._set_columns(first_row, header)
+        self._first_row = 2 if header else 1
+        self._rows = None
+        self._blank = 0
+        self._held = None
+        if columns is not None:
+            self.select(columns)
     
+    @profiler.timed("read")
     def next(self):
-        row = self.iter.next()
-        d = dict(zip(self.fieldnames, self.format_excel_row(row)))
-        if self.aliases is not None:
-            d = AliasedDict(d, self.aliases)
-        return d
-    
-    def format_excel_row(self, row):
-        def format_excel_cell(cell):
-            val = cell.value
-            if isinstance(val, datetime.datetime):
-                return val.strftime(self.date_format)
+        if self._rows is None:
+            # Don't read cells beyond the last selected column. If no columns are
+            # selected, rows are still counted, and the whole row decides whether 
+            # it is blank.
+            max_col = None
+            if self._selected:
+                max_col = max(self._selected) + 1
+            self._rows = self.sheet.iter_rows(
+                min_row=self._first_row, max_col=max_col, values_only=True)
+        
+        # Blank rows are held back until a non-blank row is found after them
+        if self._blank == 0 and self._held is None:
+            for row in self._rows:
+                if any(val is not None for val in row):
+                    self._held = row
+                    break
+                self._blank += 1
             else:
-                return str(val)
-        return map(format_excel_cell, row)
+                raise StopIteration()
+        
+        if self._blank > 0:
+            self._blank -= 1
+            return self.format_row(())
+        row = self._held
+        self._held = None
+        return self.format_row(row)
+    
+    def format_row(self, row):
+        """Convert the selected cells of a row of values to strings."""
+        n = len(row)
+        positions = xrange(self.width) if self._selected is None else self._selected
+        return tuple(self.format_value(row[i] if i < n else None) for i in positions)
+    
+    def format_value(self, val):
+        if isinstance(val, datetime.date):
+            formatted = self._dates.get(val, None)
+            if formatted is None:
+                if len(self._dates) >= self.date_cache_size:
+                    self._dates.clear()
+                formatted = self._dates[val] = val.strftime(self.date_format)
+            return formatted
+        else:
+            return str(val)
     
     def close(self):
-        pass
+        self.wb.close()
 
-class AliasedDict(dict):
-    def __init__(self, map_obj, aliases):
-        dict.__init__(self, map_obj)
-        self.aliases = aliases
-    
-    def __contains__(self, key):
-        if super(AliasedDict, self).__contains__(key):
-            return True
-        else:
-            return key in self.aliases
+class RowTemplate(object):
+    """A str.format template compiled against the columns of a table. Field names are
+    resolved to row keys once, when the template is compiled, and each row is then 
+    formatted from just the fields the template refers to, passed by position."""
+    def __init__(self, template, column_key=None, extra_fields=()):
+        """
+        template     -- str.format template with column names as fields
+        column_key   -- function that maps a column name or alias to the key used 
+                        to look it up in a row, raising KeyError for unknown columns;
+                        by default, names are used as keys
+        extra_fields -- names of fields whose values are supplied when formatting,
+                        rather than read from the row
+        """
+        self.template = template
+        self.fields = []
+        self.keys = []
+        compiled = []
+        for literal, field, spec, conversion in string.Formatter().parse(template):
+            compiled.append(literal.replace("{", "{{").replace("}", "}}"))
+            if field is None:
+                continue
+            
+            # split off any attribute or item access, e.g. {Name[0]}
+            end = min(i for i in (field.find("."), field.find("["), len(field)) if i >= 0)
+            name = field[:end]
+            if name in extra_fields:
+                key = (True, name)
+            else:
+                try:
+                    key = (False, name if column_key is None else column_key(name))
+                except KeyError:
+                    raise Exception("Unknown column {0} in template '{1}'".format(name, template))
+            
+            if key not in self.keys:
+                self.fields.append(name)
+                self.keys.append(key)
+            compiled.append("{")
+            compiled.append(str(self.keys.index(key)))
+            compiled.append(field[end:])
+            if conversion:
+                compiled.append("!" + conversion)
+            if spec:
+                compiled.append(":" + spec)
+            compiled.append("}")
+        
+        self.compiled = "".join(compiled)
     
-    def __missing__(self, key):
-        if key in self.aliases:
-            return self[self.aliases[key]]
-        raise KeyError(key)
+    @profiler.timed("format")
+    def format(self, row, extras=None):
+        """Format a row. `extras` is a dict with values for the extra fields."""
+        return self.compiled.format(*list(
+            extras[key] if extra else row[key] for extra, key in self.keys))
 
 def safe_map(fn, seq):
     if isinstance(seq, tuple) or isinstance(seq, list):
@@ -117,3 +373,28 @@ def safe_get(seq, idx):
         return seq[idx]
     else:
         return seq
+
+class ProgressReporter(object):
+    """Writes a running count of rows read and pages completed to a stream."""
+    def __init__(self, stream=sys.stderr, every=1000):
+        """
+        stream -- file-like object to write progress to
+        every  -- number of rows between progress updates
+        """
+        self.stream = stream
+        self.every = every
+        self.rows = 0
+        self.pages = 0
+    
+    def row(self):
+        self.rows += 1
+        if self.rows % self.every == 0:
+            self.report()
+    
+    def page(self, page_count):
+        self.pages = page_count
+        self.report()
+    
+    def report(self):
+        self.stream.write("Rows read: {0}, pages done: {1}\n".format(self.rows, self.pages))
+        self.stream.flush()
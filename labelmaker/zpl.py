@@ -0,0 +1,311 @@
+"""ZPL output, for Zebra and compatible thermal label printers. Rather than a PDF that
+the printer has to rasterize, each label is written as a ZPL format that uses the
+printer's own QR codes (^BQ) and fonts, so a job is a few hundred bytes per label.
+Icons are converted to monochrome graphics and downloaded to the printer (~DG) the
+first time they are used in each output file, then recalled by name (^XG).
+
+Labels are drawn exactly as they are for a PDF; each shape that a label adds is
+converted to a ZPL field by ZplLabel. Options are given in the "printer" section of
+the label config:
+
+    dpi         -- resolution of the printer, in dots per inch (default 203)
+    fontMap     -- maps reportlab font names to ZPL fonts, either a one-character
+                   font name (e.g. "0", the printer's scalable font) or the path of
+                   a font stored on the printer (e.g. "E:ARIALBD.TTF")
+    defaultFont -- ZPL font for fonts that are not in fontMap (default "0")
+"""
+import os
+
+from reportlab.graphics import shapes
+from reportlab.lib import colors, units
+
+from .labelmaker import PageRange, StreamingOutput, chunk_path
+from .util import profiler
+
+class ZplSheet(StreamingOutput):
+    """Writes a label format (^XA ... ^XZ) for each label. Has the same interface as
+    StreamingSheet, but labels are printed one at a time from a roll, so each label
+    is a page: `pages_per_file`, `start_page` and `end_page` count labels, and there
+    are no used positions to skip."""
+    default_dpi = 203
+    # Number of labels between calls to the progress reporter
+    progress_every = 100
+    
+    def __init__(self, specification, drawing_callable, outfile, progress=None,
+            pages_per_file=None, start_page=1, end_page=None, border=False, printer=None):
+        """
+        outfile   -- path of the ZPL file to write, a file-like object, or the base
+                     name of the files to write if `pages_per_file` is given
+        border    -- ignored; die-cut labels do not need a border
+        printer   -- dict of printer options; see the module documentation
+        Other arguments are the same as for StreamingSheet.
+        """
+        printer = printer or {}
+        self.specs = specification
+        self.drawing_callable = drawing_callable
+        self.outfile = outfile
+        self.progress = progress
+        self.pages_per_file = pages_per_file
+        self.pages_to_draw = PageRange(start_page, end_page)
+        self.dpi = printer.get("dpi", self.default_dpi)
+        self.font_map = printer.get("fontMap", {})
+        self.default_font = printer.get("defaultFont", "0")
+        self.page_count = 0
+        self.outfiles = []
+        self._file = None
+        self._chunk = None
+        self._icons = {}
+        self._downloads = []
+        self._group = None
+        
+        # Label size and padding, in points
+        self._lw = float(specification.label_width) * units.mm
+        self._lh = float(specification.label_height) * units.mm
+        self._lp = float(specification.left_padding) * units.mm
+        self._bp = float(specification.bottom_padding) * units.mm
+        self._dw = self._lw - self._lp - float(specification.right_padding) * units.mm
+        self._dh = self._lh - self._bp - float(specification.top_padding) * units.mm
+    
+    @property
+    def done(self):
+        """Whether all the labels to be written have been drawn."""
+        return self.pages_to_draw.after(self.page_count)
+    
+    def dots(self, points):
+        """Convert a length in points to printer dots."""
+        return int(round(points * self.dpi / 72.0))
+    
+    def partial_page(self, page, used_labels):
+        """Labels are printed from a roll, so there are no used labels to skip."""
+        pass
+    
+    def add_label(self, obj, count=1):
+        for i in xrange(count):
+            self._draw_label(obj)
+    
+    def add_labels(self, objects, count=1):
+        for obj in objects:
+            self.add_label(obj, count)
+    
+    def _draw_label(self, obj):
+        self.page_count += 1
+        if self.page_count not in self.pages_to_draw:
+            return
+        new_file = self._open_file()
+        label = ZplLabel(self)
+        self.drawing_callable(label, self._dw, self._dh, obj)
+        
+        commands = self._downloads
+        commands.append("^XA")
+        if new_file:
+            # Settings persist on the printer, so they are sent once per file
+            commands.append("^CI28^PW{0}^LL{1}^LH0,0".format(
+                self.dots(self._lw), self.dots(self._lh)))
+        commands.extend(label.fields)
+        commands.append("^XZ\n")
+        self._write("".join(commands))
+        self._downloads = []
+        
+        profiler.count("pages")
+        if self.progress is not None and self.page_count % self.progress_every == 0:
+            self.progress.page(self.page_count)
+    
+    def _open_file(self):
+        """Open the file for the current label, if it is not already open. Returns
+        whether a new file was opened."""
+        chunk = self._file_chunk()
+        if chunk == self._chunk:
+            return False
+        self._close_file()
+        path = self.outfile
+        if self.pages_per_file is not None:
+            path = chunk_path(self.outfile, chunk, ".zpl")
+        self._file = path if hasattr(path, "write") else open(path, "wb")
+        self.outfiles.append(path)
+        self._chunk = chunk
+        # Each file downloads the icons it uses
+        self._icons.clear()
+        return True
+    
+    def _close_file(self):
+        if self._file is not None and self._file is not self.outfile:
+            self._file.close()
+        self._file = None
+    
+    def _write(self, text):
+        if not isinstance(text, bytes):
+            text = text.encode("utf-8")
+        self._file.write(text)
+    
+    def icon(self, path, width, height):
+        """Returns the name of the stored graphic for an icon drawn at `width` x
+        `height` dots, downloading it before the current label if it is the first
+        time the icon is used in this file."""
+        key = (path, width, height)
+        name = self._icons.get(key, None)
+        if name is None:
+            name = self._icons[key] = "ICON{0:04d}".format(len(self._icons) + 1)
+            total, row_bytes, data = icon_graphic(path, width, height)
+            self._downloads.append("~DGR:{0}.GRF,{1},{2},{3}\n".format(
+                name, total, row_bytes, data))
+        return name
+    
+    def font(self, font_name, height):
+        """Returns the font command for a reportlab font at `height` dots."""
+        font = self.font_map.get(font_name, self.default_font)
+        if len(font) == 1:
+            return "^A{0}N,{1}".format(font, height)
+        return "^A@N,{0},,{1}".format(height, font)
+    
+    def _finish(self):
+        # Labels are written as they are drawn, so only the last count is reported
+        if self.progress is not None:
+            self.progress.page(self.page_count)
+
+class ZplLabel(object):
+    """Stands in for the Drawing that a label is drawn on, converting each shape to
+    ZPL fields as it is added. Strings are printed in the printer's fonts, QR codes
+    (a QrPath) are encoded by the printer, icons are recalled from stored graphics,
+    and filled rectangles are printed as boxes. Groups may only be translated."""
+    # QR codes are only placed on the label, not encoded (see QrCache.get)
+    encodes_qr = True
+    
+    def __init__(self, sheet):
+        self.sheet = sheet
+        self.fields = []
+    
+    def add(self, node, name=None):
+        self.fields.extend(self.convert(node))
+    
+    def convert(self, node, dx=0, dy=0):
+        """Returns the ZPL fields for a shape, offset by (dx, dy) points."""
+        if isinstance(node, shapes.String):
+            return [self.string(node, dx, dy)]
+        elif isinstance(node, shapes.Image):
+            return [self.image(node, dx, dy)]
+        elif isinstance(node, shapes.Group):
+            return self.group(node, dx, dy)
+        elif isinstance(node, shapes.Path) and getattr(node, "code", None) is not None:
+            return [self.qr(node.code, dx, dy)]
+        elif isinstance(node, shapes.Path) and hasattr(node, "rects"):
+            return list(self.box(x + dx, y + dy, width, height, node.fillColor)
+                for x, y, width, height in node.rects)
+        elif isinstance(node, shapes.Rect) and not node.rx and not node.ry:
+            return [self.box(node.x + dx, node.y + dy, node.width, node.height,
+                node.fillColor)]
+        raise Exception("Cannot print {0} on a ZPL label".format(node.__class__.__name__))
+    
+    def x(self, x):
+        return self.sheet.dots(self.sheet._lp + x)
+    
+    def y(self, y):
+        """ZPL measures down from the top of the label."""
+        return self.sheet.dots(self.sheet._lh - self.sheet._bp - y)
+    
+    def group(self, group, dx, dy):
+        transform = tuple(group.transform)
+        if transform[:4] != (1, 0, 0, 1):
+            raise Exception("Cannot print a scaled or rotated group on a ZPL label")
+        dx += transform[4]
+        dy += transform[5]
+        # The body shared by the copies of a label is the same group each time
+        cached = self.sheet._group
+        if cached is not None and cached[0] is group and cached[1] == (dx, dy):
+            return cached[2]
+        fields = []
+        for node in group.getContents():
+            fields.extend(self.convert(node, dx, dy))
+        self.sheet._group = (group, (dx, dy), fields)
+        return fields
+    
+    def string(self, string, dx, dy):
+        x = self.x(string.x + dx)
+        y = self.y(string.y + dy)
+        font = self.sheet.font(string.fontName, self.sheet.dots(string.fontSize))
+        data = field_data(string.text)
+        if string.textAnchor == "end":
+            # Right-justified in a one-line block that ends at x
+            return u"^FT0,{0}{1}^FB{2},1,0,R^FH^FD{3}^FS".format(y, font, x, data)
+        elif string.textAnchor == "middle":
+            half = min(x, self.sheet.dots(self.sheet._lw) - x)
+            return u"^FT{0},{1}{2}^FB{3},1,0,C^FH^FD{4}^FS".format(
+                x - half, y, font, 2 * half, data)
+        return u"^FT{0},{1}{2}^FH^FD{3}^FS".format(x, y, font, data)
+    
+    def image(self, image, dx, dy):
+        name = self.sheet.icon(image.path,
+            self.sheet.dots(image.width), self.sheet.dots(image.height))
+        return "^FO{0},{1}^XGR:{2}.GRF,1,1^FS".format(
+            self.x(image.x + dx), self.y(image.y + dy + image.height), name)
+    
+    def qr(self, code, dx, dy):
+        # The printer sizes the code in whole dots per module
+        box = code["box"] * self.sheet.dpi / 72.0
+        magnification = max(1, min(10, int(box)))
+        value = code["value"]
+        if not isinstance(value, bytes):
+            value = value.encode("utf-8")
+        data = bytearray(value)
+        if all(32 <= b < 127 for b in data):
+            # Automatic mode lets the printer choose the most compact encoding
+            data = "A," + field_data(value.decode("ascii"))
+        else:
+            data = "M,B{0:04d}{1}".format(len(data),
+                "".join(_escape_byte(b) for b in data))
+        return "^FO{0},{1}^BQN,2,{2}^FH^FD{3}{4}^FS".format(
+            self.x(code["x"] + dx), self.y(code["top"] + dy), magnification,
+            code["level"], data)
+    
+    def box(self, x, y, width, height, color):
+        if color is None:
+            return ""
+        width = max(1, self.sheet.dots(width))
+        height = max(1, self.sheet.dots(height))
+        # Boxes are filled by making the border as thick as the box
+        return "^FO{0},{1}^GB{2},{3},{4},{5}^FS".format(self.x(x), self.y(y) - height,
+            width, height, min(width, height), "W" if color == colors.white else "B")
+
+# Characters that cannot appear as themselves in a field after ^FH
+_SPECIAL = frozenset("^~_")
+
+def field_data(text):
+    """Escape text for a field that follows ^FH: special characters and control
+    characters are written as _XX hex codes. Other characters are written as UTF-8
+    (^CI28)."""
+    if isinstance(text, bytes):
+        text = text.decode("utf-8")
+    return u"".join(
+        "_{0:02X}".format(ord(c)) if c in _SPECIAL or ord(c) < 32 or c == "\x7f" else c
+        for c in text)
+
+def _escape_byte(b):
+    if 32 <= b < 127 and chr(b) not in _SPECIAL:
+        return chr(b)
+    return "_{0:02X}".format(b)
+
+# Converted icons, shared by all jobs in a process
+_graphics = {}
+
+def icon_graphic(path, width, height):
+    """Convert an image to a ZPL graphic of `width` x `height` dots. Pixels darker
+    than 50% grey (after compositing onto white) are printed. Returns a tuple
+    (total bytes, bytes per row, hex data), as needed by ~DG."""
+    key = (path, os.path.getmtime(path), width, height)
+    graphic = _graphics.get(key, None)
+    if graphic is None:
+        from PIL import Image
+        image = Image.open(path).convert("RGBA")
+        background = Image.new("RGBA", image.size, (255, 255, 255, 255))
+        image = Image.alpha_composite(background, image).convert("L")
+        pixels = list(image.resize((width, height)).getdata())
+        
+        row_bytes = (width + 7) // 8
+        rows = []
+        for y in xrange(height):
+            row = bytearray(row_bytes)
+            for x in xrange(width):
+                if pixels[y * width + x] < 128:
+                    row[x // 8] |= 0x80 >> (x % 8)
+            rows.append("".join("{0:02X}".format(b) for b in row))
+        graphic = _graphics[key] = (row_bytes * height, row_bytes, "".join(rows))
+    return graphic
@@ -0,0 +1,63 @@
+"""Check jobs run by labelmaker.service, as they are read from JSON."""
+import base64
+import json
+import os
+import re
+import shutil
+import tempfile
+import unittest
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from labelmaker.labelmaker import qr_cache
+from labelmaker.service import LabelService, run_batch
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "examples")
+
+# Non-ASCII text, which json.loads returns as unicode on Python 2
+ROWS = [["Name", "URL"], [u"Jos\xe9", u"http://example.com/caf\xe9/" + "x" * 40]]
+
+class ServiceTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        qr_cache.clear()
+        with open(os.path.join(EXAMPLES, "big-labels.json")) as fh:
+            config = json.load(fh)
+        # Compressed QR codes encode the UTF-8 of the text
+        config["qr"]["compress"] = True
+        self.label_config = os.path.join(self.tempdir, "labels.json")
+        with open(self.label_config, "w") as fh:
+            json.dump(config, fh)
+    
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+    
+    def job(self, **kwargs):
+        job = dict(id=1, labelConfig=self.label_config, rows=ROWS,
+            textStrings=["{Name}", "{URL}"], qrString="{URL}")
+        job.update(kwargs)
+        # As the service reads it
+        return json.loads(json.dumps(job))
+    
+    def assertPdf(self, response):
+        self.assertNotIn("error", response)
+        self.assertTrue(base64.b64decode(response["pdf"]).startswith(b"%PDF"))
+    
+    def test_serve_non_ascii(self):
+        out = StringIO()
+        LabelService().serve(StringIO(json.dumps(self.job()) + "\n"), out)
+        self.assertPdf(json.loads(out.getvalue()))
+    
+    def test_batch_non_ascii(self):
+        responses = list(run_batch([self.job(id=1), self.job(id=2, renderer="zpl")]))
+        self.assertPdf(responses[0])
+        self.assertNotIn("error", responses[1])
+        # The compressed code is sent as bytes
+        zpl = base64.b64decode(responses[1]["zpl"]).decode("utf-8")
+        self.assertIsNotNone(re.search(r"\^BQN,2,\d+\^FH\^FD[LMQH]M,B\d{4}", zpl))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+"""Check that make-labels.py does not import reportlab until it has parsed its
+arguments. Each check runs the script in a fresh interpreter, since other tests
+import reportlab."""
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT, "bin", "make-labels.py")
+
+# Runs the script with the given arguments, then reports whether reportlab was imported
+RUN_SCRIPT = """
+import runpy, sys
+sys.argv = sys.argv[1:]
+try:
+    runpy.run_path(sys.argv[0], run_name="__main__")
+except SystemExit:
+    pass
+sys.stderr.write("\\nreportlab imported: {0}\\n".format("reportlab" in sys.modules))
+"""
+
+class StartupTest(unittest.TestCase):
+    def run_script(self, *args):
+        env = dict(os.environ, PYTHONPATH=ROOT)
+        proc = subprocess.Popen((sys.executable, "-c", RUN_SCRIPT, SCRIPT) + args,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+        out, err = proc.communicate()
+        return out.decode("utf-8"), err.decode("utf-8")
+    
+    def test_help(self):
+        out, err = self.run_script("--help")
+        self.assertIn("usage:", out)
+        self.assertIn("reportlab imported: False", err)
+    
+    def test_usage_error(self):
+        out, err = self.run_script("-f", "table.csv")
+        self.assertIn("-o/--outfile is required", err)
+        self.assertIn("reportlab imported: False", err)
+    
+    def test_run(self):
+        # Check that the script reports imports at all
+        out, err = self.run_script("--check", "--no-config-cache", "-l",
+            os.path.join(ROOT, "examples", "big-labels.json"),
+            "-f", os.path.join(ROOT, "examples", "example.csv"))
+        self.assertIn("reportlab imported: True", err)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+"""Check the table readers in labelmaker.util."""
+import os
+import shutil
+import tempfile
+import unittest
+
+from labelmaker.util import CsvReader, ExcelReader
+
+ROWS = (("Name", "URL"), ("A", "u1"), ("B", "u2"), ("C", "u3"))
+
+class ReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+    
+    def csv_file(self, text):
+        path = os.path.join(self.tempdir, "table.csv")
+        with open(path, "w") as fh:
+            fh.write(text)
+        return path
+    
+    def excel_file(self, rows):
+        from openpyxl import Workbook
+        path = os.path.join(self.tempdir, "table.xlsx")
+        wb = Workbook()
+        for row in rows:
+            wb.active.append(row)
+        wb.save(path)
+        return path
+    
+    def read(self, reader):
+        try:
+            return list(reader)
+        finally:
+            reader.close()
+    
+    def test_csv_columns(self):
+        path = self.csv_file("Name,URL\nA,u1\nB,u2\n")
+        self.assertEqual(self.read(CsvReader(path)), [("A", "u1"), ("B", "u2")])
+        self.assertEqual(self.read(CsvReader(path, columns=["URL"])), [("u1",), ("u2",)])
+    
+    def test_csv_blank_lines(self):
+        # Blank lines are skipped, as csv.DictReader skips them
+        path = self.csv_file("Name,URL\nA,u1\n\nB,u2\n\n")
+        self.assertEqual(self.read(CsvReader(path)), [("A", "u1"), ("B", "u2")])
+    
+    def test_csv_no_columns(self):
+        # Fixed templates use no columns, but there is still a label for each row
+        path = self.csv_file("Name,URL\nA,u1\nB,u2\n")
+        self.assertEqual(self.read(CsvReader(path, columns=[])), [(), ()])
+    
+    def test_excel_columns(self):
+        path = self.excel_file(ROWS)
+        self.assertEqual(self.read(ExcelReader(path, 1)), list(ROWS[1:]))
+        self.assertEqual(self.read(ExcelReader(path, 1, columns=["URL"])),
+            [("u1",), ("u2",), ("u3",)])
+    
+    def test_excel_no_columns(self):
+        path = self.excel_file(ROWS)
+        self.assertEqual(self.read(ExcelReader(path, 1, columns=[])), [(), (), ()])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+"""Check the ZPL command streams written by labelmaker.zpl, without a printer."""
+from io import BytesIO
+import os
+import re
+import shutil
+import tempfile
+import unittest
+import zlib
+
+import labels
+from reportlab.graphics import shapes
+
+from labelmaker.labelmaker import qr_cache
+from labelmaker.zpl import ZplSheet, field_data
+
+def draw_nodes(label, width, height, nodes):
+    for node in nodes:
+        label.add(node)
+
+def qr_node(value, outline=True, compress=None):
+    return qr_cache.get(value, "M", compress=compress, outline=outline, barWidth=60, 
+        barHeight=60)[0]
+
+class ZplTest(unittest.TestCase):
+    def setUp(self):
+        self.spec = labels.Specification(100, 100, 1, 1, 90, 30)
+        self.tempdir = tempfile.mkdtemp()
+        qr_cache.clear()
+    
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+    
+    def write(self, label_nodes, **kwargs):
+        """Returns the ZPL written for a list of labels, each a list of shapes."""
+        out = BytesIO()
+        sheet = ZplSheet(self.spec, draw_nodes, out, **kwargs)
+        sheet.add_labels(label_nodes)
+        sheet.save()
+        return out.getvalue().decode("utf-8")
+    
+    def icon(self, name="icon.png"):
+        from PIL import Image
+        path = os.path.join(self.tempdir, name)
+        image = Image.new("RGBA", (10, 10), (255, 255, 255, 0))
+        for x in range(5):
+            image.putpixel((x, 0), (0, 0, 0, 255))
+        image.save(path)
+        return path
+    
+    def test_labels(self):
+        zpl = self.write([[shapes.String(0, 0, "A")], [shapes.String(0, 0, "B")]])
+        self.assertEqual(zpl.count("^XA"), 2)
+        self.assertEqual(zpl.count("^XZ"), 2)
+        # Printer settings are sent once per file
+        self.assertEqual(zpl.count("^CI28"), 1)
+        self.assertTrue(zpl.startswith("^XA^CI28^PW"))
+    
+    def test_qr_field(self):
+        zpl = self.write([[qr_node("http://example.com/a^b")]])
+        match = re.search(r"\^FO(\d+),(\d+)\^BQN,2,(\d+)\^FH\^FD(.*?)\^FS", zpl)
+        self.assertIsNotNone(match)
+        self.assertTrue(1 <= int(match.group(3)) <= 10)
+        # Error correction level, automatic input mode, escaped data
+        self.assertEqual(match.group(4), "MA,http://example.com/a_5Eb")
+    
+    def test_qr_binary_field(self):
+        # Text that is longer when compressed is sent as UTF-8
+        zpl = self.write([[qr_node(u"caf\xe9")]])
+        self.assertIn("^FDMM,B0005caf_C3_A9^FS", zpl)
+    
+    def test_qr_compressed_field(self):
+        # Text that is shorter when compressed is compressed as UTF-8
+        value = u"caf\xe9 " * 20
+        zpl = self.write([[qr_node(value)]])
+        data = bytearray(zlib.compress(value.encode("utf-8"), 9))
+        self.assertIn("^FDMM,B{0:04d}".format(len(data)), zpl)
+        self.assertEqual(self.write([[qr_node(value, compress=True)]]), zpl)
+    
+    def test_qr_outline(self):
+        # A code that is only placed is printed the same as one that is encoded
+        value = "http://example.com/outline"
+        outline = qr_node(value).getContents()[0]
+        encoded = qr_node(value, outline=False).getContents()[0]
+        self.assertEqual(outline.rects, [])
+        self.assertNotEqual(encoded.rects, [])
+        self.assertEqual(outline.code, encoded.code)
+        self.assertEqual(self.write([[qr_node(value)]]),
+            self.write([[qr_node(value, outline=False)]]))
+    
+    def test_icons(self):
+        icon = shapes.Image(0, 0, 10, 10, self.icon())
+        zpl = self.write([[icon], [icon]])
+        # Downloaded before the first label that uses it, then recalled by name
+        self.assertEqual(zpl.count("~DG"), 1)
+        self.assertTrue(zpl.startswith("~DGR:ICON0001.GRF,"))
+        self.assertEqual(zpl.count("^XGR:ICON0001.GRF,1,1^FS"), 2)
+        total, row_bytes, data = re.match(r"~DGR:ICON0001.GRF,(\d+),(\d+),(\w+)\n",
+            zpl).groups()
+        # 10 points is 28 dots at 203 dpi
+        self.assertEqual(int(row_bytes), 4)
+        self.assertEqual(int(total), 4 * 28)
+        self.assertEqual(len(data), 2 * int(total))
+    
+    def test_icons_per_file(self):
+        icon = shapes.Image(0, 0, 10, 10, self.icon())
+        base = os.path.join(self.tempdir, "out.zpl")
+        sheet = ZplSheet(self.spec, draw_nodes, base, pages_per_file=1)
+        sheet.add_labels([[icon], [icon]])
+        sheet.save()
+        self.assertEqual(len(sheet.outfiles), 2)
+        for path in sheet.outfiles:
+            with open(path, "rb") as fh:
+                zpl = fh.read().decode("utf-8")
+            # Each file downloads the icons it uses
+            self.assertEqual(zpl.count("~DGR:ICON0001.GRF,"), 1)
+            self.assertEqual(zpl.count("^XGR:ICON0001.GRF,1,1^FS"), 1)
+    
+    def test_field_data(self):
+        self.assertEqual(field_data("plain text"), "plain text")
+        self.assertEqual(field_data("a^b~c_d"), "a_5Eb_7Ec_5Fd")
+        self.assertEqual(field_data("tab\tnew\n"), "tab_09new_0A")
+        self.assertEqual(field_data(u"caf\xe9"), u"caf\xe9")
+    
+    def test_string_field(self):
+        zpl = self.write([[shapes.String(0, 0, "x^y", fontName="Helvetica", fontSize=10)]])
+        self.assertIsNotNone(re.search(r"\^FT\d+,\d+\^A0N,28\^FH\^FDx_5Ey\^FS", zpl))
+
+if __name__ == "__main__":
+    unittest.main()